@@ -7,35 +7,277 @@ Created on Sat Jul 20 19:27:41 2019
 """
 
 # Analysis Functions for Getis Ord Hotspot Analysis
-import czifile
+# czifile, tifffile and tqdm are imported where they are first used, so that the compute-only path (readImage,
+# preprocessImage and the engines) loads quickly in every worker process
 import os
+import tempfile
 import cv2
-from skimage import io
 import numpy as np
 import pandas as pd
-import scipy.stats as st
-from tqdm import tqdm_notebook
 
-import dask
-from dask.diagnostics import ProgressBar
+from EngineFunctions import *
 
-# Load image file based on file type
+# Lazily opened CZI or TIFF file. Nothing is decoded until a channel is requested, and then only that
+# channel's CZI subblocks or TIFF page are read. When the plane is stored uncompressed in one piece it is
+# returned as a read-only memory-mapped view of the file instead of a copy.
+class ImageLoader:
+
+    def __init__(self, imgPath, imgName):
+        self.path = os.path.join(imgPath, imgName)
+        self.format = imgName.split(".")[1]
+        if self.format not in ('czi', 'tif', 'tiff'):
+            raise Exception("Image file is not of an appropriate file format for hotspot analysis (i.e. TIFF or CZI)")
+        self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    # Opens the file and reads its directory on first use
+    @property
+    def file(self):
+        if self._file is None:
+            if self.format == 'czi':
+                import czifile
+                self._file = czifile.CziFile(self.path)
+            else:
+                import tifffile
+                self._file = tifffile.TiffFile(self.path)
+        return self._file
+
+    @property
+    def shape(self):
+        if self.format == 'czi':
+            return (self.file.shape[self.file.axes.index('Y')], self.file.shape[self.file.axes.index('X')])
+        if self._interleaved():
+            return tuple(self.file.series[0].shape[-3:-1])
+        return tuple(self.file.series[0].shape[-2:])
+
+    @property
+    def dtype(self):
+        return np.dtype(self.file.dtype) if self.format == 'czi' else self.file.series[0].dtype
+
+    @property
+    def channels(self):
+        if self.format == 'czi':
+            return self.file.shape[self.file.axes.index('C')]
+        series = self.file.series[0]
+        axis = self._channelAxis()
+        if axis is not None:
+            return series.shape[axis]
+        if series.keyframe.ndim == 2:
+            return 1
+        return series.keyframe.shape[-1 if self._interleaved() else 0]
+
+    # Position of the TIFF channel axis among the series axes stored across pages: the 'C' axis (e.g. of ImageJ
+    # ZCYX hyperstacks or OME CZYX stacks), else the first of them when pages hold a single plane (TIFFs saved
+    # without axis metadata). None when every page holds all channels as samples.
+    def _channelAxis(self):
+        series = self.file.series[0]
+        leading = series.axes[:len(series.shape) - series.keyframe.ndim]
+        if 'C' in leading:
+            return leading.index('C')
+        if leading and series.keyframe.ndim == 2:
+            return 0
+        return None
+
+    # Whether a TIFF stores its channels as interleaved samples of one page (Y, X, S)
+    def _interleaved(self):
+        import tifffile
+        keyframe = self.file.series[0].keyframe
+        return keyframe.ndim == 3 and keyframe.planarconfig == tifffile.PLANARCONFIG.CONTIG
+
+    # Returns one channel as a 2-D array. out='memmap' decodes into a temporary memmap on disk instead of RAM.
+    def channel(self, img_channel, out=None):
+        if not 0 <= img_channel < self.channels:
+            raise Exception("Channel %d does not exist; %s has %d channels" % (img_channel, self.path, self.channels))
+        if self.format == 'czi':
+            return self._cziChannel(img_channel, out)
+        return self._tiffChannel(img_channel, out)
+
+    def _output(self, out):
+        if out == 'memmap':
+            return np.memmap(tempfile.NamedTemporaryFile(suffix='.dat'), dtype=self.dtype, mode='w+', shape=self.shape)
+        return np.zeros(self.shape, dtype=self.dtype)
+
+    def _cziChannel(self, img_channel, out):
+        czi = self.file
+        yi, xi = czi.axes.index('Y'), czi.axes.index('X')
+        # Subblocks of the requested channel in the first plane of every other dimension
+        target = [img_channel if axis == 'C' else 0 for axis in czi.axes]
+        entries = [entry for entry in czi.filtered_subblock_directory
+                   if all(i in (yi, xi) or start - offset == t
+                          for i, (start, offset, t) in enumerate(zip(entry.start, czi.start, target)))]
+
+        if len(entries) == 1 and not entries[0].compression and entries[0].stored_shape == entries[0].shape \
+                and (entries[0].shape[yi], entries[0].shape[xi]) == self.shape and entries[0].shape[-1] == 1:
+            segment = entries[0].data_segment()
+            return np.memmap(self.path, dtype=entries[0].dtype, mode='r', offset=segment.data_offset, shape=self.shape)
+
+        img = self._output(out)
+        for entry in entries:
+            tile = entry.data_segment().data()
+            tile = tile.reshape(tile.shape[yi], tile.shape[xi])
+            y0 = entry.start[yi] - czi.start[yi]
+            x0 = entry.start[xi] - czi.start[xi]
+            img[y0:y0+tile.shape[0], x0:x0+tile.shape[1]] = tile
+        return img
+
+    def _tiffChannel(self, img_channel, out):
+        import tifffile
+        series = self.file.series[0]
+        leading = series.shape[:len(series.shape) - series.keyframe.ndim]
+        axis = self._channelAxis()
+        if axis is not None:
+            # Pages are stored in C order of the leading axes; every axis but the channel's (e.g. Z or T) is read
+            # at its first plane
+            page, sample = series.pages[img_channel*int(np.prod(leading[axis+1:], dtype=np.int64))], 0
+        else:
+            # Every page holds all channels as sample planes; read them from the first page
+            page, sample = series.pages[0], img_channel
+        if page.keyframe.ndim == 2:
+            try:
+                return tifffile.memmap(self.path, page=page.index, mode='r')
+            except ValueError:
+                pass
+            img = self._output(out)
+            page.asarray(out=img)
+            return img
+        try:
+            planes = tifffile.memmap(self.path, page=page.index, mode='r')
+            return planes[..., sample] if self._interleaved() else planes[sample]
+        except ValueError:
+            pass
+        img = self._output(out)
+        if page.keyframe.planarconfig == tifffile.PLANARCONFIG.SEPARATE:
+            self._tiffSample(page, sample, img)
+        else:
+            # Interleaved samples cannot be decoded apart: decode the page into a temporary memmap, not RAM
+            img[:] = page.asarray(out='memmap')[..., sample]
+        return img
+
+    # Decodes only the strips or tiles of one sample plane of a planar page into img
+    def _tiffSample(self, page, sample, img):
+        fh = self.file.filehandle
+        keyframe = page.keyframe
+        perSample = len(page.dataoffsets) // keyframe.samplesperpixel
+        for i in range(sample*perSample, (sample + 1)*perSample):
+            if not page.databytecounts[i]:
+                continue
+            with fh.lock:
+                fh.seek(page.dataoffsets[i])
+                data = fh.read(page.databytecounts[i])
+            segment, (s, d, y, x, _), shape = keyframe.decode(data, i, jpegtables=keyframe.jpegtables)
+            h, w = min(shape[1], img.shape[0] - y), min(shape[2], img.shape[1] - x)
+            img[y:y+h, x:x+w] = segment[0, :h, :w, 0]
+
+
+
+# Load image file based on file type; only the image and DAPI channels are decoded
 def loadImage(imgPath, imgName, img_channel=1, DAPI_channel=0):
-    if imgName.split(".")[1] == 'czi':
-        image = czifile.imread(os.path.join(imgPath, imgName))
-        DAPI = image[0,DAPI_channel,0,0,:,:,0]
-        img  = image[0,img_channel,0,0,:,:,0]
-
-    elif imgName.split(".")[1] == 'tif' or imgName.split(".")[1] == 'tiff':
-        #image = cv2.imread(os.path.join(imgPath, imgName))
-        image = io.imread(os.path.join(imgPath, imgName))
-        DAPI = image[DAPI_channel,:,:]
-        img  = image[img_channel,:,:]
-    else:
-        raise Exception("Image file is not of an appropriate file format for hotspot analysis (i.e. TIFF or CZI)")
+    with ImageLoader(imgPath, imgName) as loader:
+        img = np.array(loader.channel(img_channel))
+        DAPI = np.array(loader.channel(DAPI_channel))
     return img, DAPI
 
 
+# Opens one channel of a TIFF or CZI file for out-of-core analysis (see Getis_chunked) without decoding the
+# whole file into RAM: planes stored uncompressed are memory-mapped in place, and anything else is decoded into
+# a temporary memmap on disk
+def loadImageChunked(imgPath, imgName, img_channel=1):
+    return ImageLoader(imgPath, imgName).channel(img_channel, out='memmap')
+
+
+# Reads a single-channel image file as cv2.imread()[:,:,0], i.e. at 8 bits per pixel as the thresholds of the batch
+# notebooks assume. With native_depth=True the file is read at its own bit depth instead (channel 0 of color images);
+# its threshold is then rescaled with depthThreshold.
+def readImage(path, native_depth=False):
+    img = cv2.imread(path, cv2.IMREAD_UNCHANGED if native_depth else cv2.IMREAD_COLOR)
+    if img is None:
+        raise Exception("Could not read image " + path)
+    return img if img.ndim == 2 else np.ascontiguousarray(img[:,:,0])
+
+
+def bitDepth(dtype):
+    return np.dtype(dtype).itemsize*8
+
+
+# Threshold on the 8-bit scale rescaled to an image of the given integer dtype. cv2 reduces deeper images to 8 bits
+# by dropping their low bits, so an 8-bit pixel is above threshold exactly when the native pixel is above the last
+# value of the threshold's 8-bit step (float images are left at the given threshold).
+def depthThreshold(threshold, dtype):
+    if not np.issubdtype(dtype, np.integer):
+        return threshold
+    return (np.floor(threshold) + 1)*2**(bitDepth(dtype) - 8) - 1
+
+
+# Downsampling factor of a downsample setting: True means 2, False or 0 means none
+def downsampleFactor(downsample):
+    return 2 if downsample is True else max(int(downsample), 1)
+
+
+
+# Mean of every factor x factor block (the last blocks zero-padded, as block_reduce), truncated to the image's dtype
+def blockMean(img, factor):
+    H, W = img.shape
+    padH, padW = -H % factor, -W % factor
+    if padH or padW:
+        img = np.pad(img, ((0, padH), (0, padW)))
+    blocks = img.reshape((H + padH)//factor, factor, (W + padW)//factor, factor)
+    if np.issubdtype(img.dtype, np.integer):
+        return (blocks.sum(axis=(1,3), dtype=np.int64) // factor**2).astype(img.dtype)
+    return blocks.mean(axis=(1,3)).astype(img.dtype)
+
+
+# Mean of the (block-mean downsampled) image, streamed in bands of rows so the downsampled frame is never held
+def downsampledMean(img, factor, band=1024):
+    if factor == 1:
+        return np.mean(img)
+    total = 0.0
+    rows = band*factor
+    for start in range(0, img.shape[0], rows):
+        total += np.sum(blockMean(img[start:start+rows], factor), dtype=float)
+    return total / (-(-img.shape[0]//factor)*-(-img.shape[1]//factor))
+
+
+
+# Preprocessing of one image for Getis: downsample by `downsample` (block means; True means 2), replace pixels
+# above threshold with the mean of the whole downsampled frame, mask with the ROI and crop to the ROI.
+# The ROI is cropped first and only its bounding box is downsampled and clamped, in the image's own dtype, so the
+# only full-frame work is one streamed pass for the mean. mask is a full-frame mask or a mask cropped to `bounds`,
+# at the downsampled resolution (a full-frame mask at full resolution is downsampled by block majority).
+# Returns the cropped mask and a masked array over a single contiguous copy of the cropped image.
+def preprocessImage(img, mask, threshold, downsample=1, bounds=None):
+    factor = downsampleFactor(downsample)
+    shape = (-(-img.shape[0]//factor), -(-img.shape[1]//factor))
+    mask = np.asarray(mask, dtype=bool)
+    if bounds is None:
+        if factor > 1 and mask.shape == img.shape:
+            mask = blockMean(mask.astype(np.uint8)*2, factor) >= 1
+        if mask.shape != shape:
+            raise Exception("ROI shape " + str(mask.shape) + " does not match the image shape " + str(shape))
+        bounds = maskBounds(mask)
+        mask = mask[bounds[0]:bounds[1], bounds[2]:bounds[3]]
+    xmin, xmax, ymin, ymax = bounds
+    if xmax > shape[0] or ymax > shape[1]:
+        raise Exception("ROI bounds " + str(tuple(bounds)) + " fall outside the image shape " + str(shape))
+
+    # Remove saturated pixels using the mean of the whole (downsampled) frame
+    avgPixel = downsampledMean(img, factor)
+    cropped = img[xmin*factor:xmax*factor, ymin*factor:ymax*factor]
+    cropped = blockMean(cropped, factor) if factor > 1 else cropped.copy()
+    cropped[cropped > threshold] = avgPixel
+    return mask, np.ma.array(cropped, mask=~mask, copy=False)
+
+
+
 # Creates n by m binned matrix of data
 def submatsum(data,n,m):
     # return a matrix of shape (n,m)
@@ -55,23 +297,16 @@ def neighbours(im, x, y, nx, ny):
 
 # Getis function: Calculates Gi* statistic for all neighborhoods in an image ROI
 def Getis(mask, maskedImage, nx, ny):
-    stats = pd.DataFrame({'x':[],'y':[],'nx':[],'ny':[],
-                          'Gi':[],'Mean':[],'Variance':[],'SD':[],
-                          'Z-Score':[],'p-value':[],'Sign':[]})
+    stats = []
     maskedImage = maskedImage.astype(float)
     im = maskedImage.copy()
     n = np.sum(mask, dtype=float)
-    # Iterate through each neighborhood
-    coords = [[]]
-    for x in np.arange(nx,im.shape[0] - (int(nx/2)),nx):
-        for y in np.arange(ny,im.shape[1] - (int(ny/2)),ny):
-            isValid = neighbours(mask, x, y, int(nx/2), int(ny/2))
-            # Get G statistic for this neighborhood
-            if np.sum(isValid) == isValid.size:
-                coords.append((x,y))
-            else:
-                continue
-    for coord in tqdm_notebook(coords[1:], desc='Processing neighborhoods:'):
+    # Iterate through each neighborhood that lies entirely inside the ROI
+    xs, ys, coverage = coverageIndex(mask, nx, ny)
+    rows, cols = np.nonzero(coverage == 1)
+    coords = list(zip(xs[rows], ys[cols]))
+    from tqdm.auto import tqdm
+    for coord in tqdm(coords, desc='Processing neighborhoods:'):
         x = coord[0]
         y = coord[1]
         wdxj = neighbours(im, x, y, int(nx/2), int(ny/2))
@@ -84,17 +319,19 @@ def Getis(mask, maskedImage, nx, ny):
         EGi = Wi / n
         Var = Wi*(n - Wi)*Yi2 / ((n**2)*(n - 1)*(Yi1**2))
         Zi = (Gi - EGi) / np.sqrt(Var)
-        p = st.norm.pdf(Zi)
+        p = normPDF(Zi)
         if Zi >= 0:
             sign = "+"
         else:
             sign = "-"
-        stat = pd.DataFrame({'x':[x], 'y':[y], 'nx':[nx], 'ny':[ny],
-                             'Gi':[np.round(Gi,10)], 'Mean':[np.round(Yi1,10)],
-                             'Variance' : [np.round(Var,10)], 'SD':[np.round(np.sqrt(Var),10)],
-                             'Z-Score':[np.round(Zi,10)], 'p-value':[np.round(p,20)], 'Sign':[sign]})
-        stats = stats.append(stat, ignore_index=True)
-    return stats
+        stats.append({'x':x, 'y':y, 'nx':nx, 'ny':ny,
+                      'Gi':np.round(Gi,10), 'Mean':np.round(Yi1,10),
+                      'Variance' : np.round(Var,10), 'SD':np.round(np.sqrt(Var),10),
+                      'Z-Score':np.round(Zi,10), 'p-value':np.round(p,20), 'Sign':sign})
+    # One table built at the end (DataFrame.append is gone from pandas 2), with the float columns it always had
+    if not stats:
+        return pd.DataFrame({column:[] for column in STATS_COLUMNS})
+    return pd.DataFrame(stats, columns=STATS_COLUMNS).astype({column:float for column in STATS_COLUMNS[:-1]})
 
 
 def Getis_per_neighborhood(im, n, coord, nx=20, ny=20):
@@ -110,7 +347,7 @@ def Getis_per_neighborhood(im, n, coord, nx=20, ny=20):
     EGi = Wi / n
     Var = Wi*(n - Wi)*Yi2 / ((n**2)*(n - 1)*(Yi1**2))
     Zi = (Gi - EGi) / np.sqrt(Var)
-    p = st.norm.pdf(Zi)
+    p = normPDF(Zi)
     if Zi >= 0:
         sign = "+"
     else:
@@ -123,73 +360,114 @@ def Getis_per_neighborhood(im, n, coord, nx=20, ny=20):
     return stat
 
 
-def Getis_parallel(mask, maskedImage, nx, ny):
-    stats = pd.DataFrame({'x':pd.Series(dtype='float'),
-                          'y':pd.Series(dtype='float'),
-                          'nx':pd.Series(dtype='float'),
-                          'nx':pd.Series(dtype='float'),
-                          'Gi':pd.Series(dtype='float'),
-                          'Mean':pd.Series(dtype='float'),
-                          'Variance':pd.Series(dtype='float'),
-                          'SD':pd.Series(dtype='float'),
-                          'Z-Score':pd.Series(dtype='float'),
-                          'p-value':pd.Series(dtype='float'),
-                          'Sign':pd.Series(dtype='str')})
-    maskedImage = maskedImage.astype(float)
-    im = maskedImage.copy()
-    n = np.sum(mask, dtype=float)
-    # Iterate through each neighborhood
-    coords = [[]]
-    for x in np.arange(nx,im.shape[0] - (int(nx/2)),nx):
-        for y in np.arange(ny,im.shape[1] - (int(ny/2)),ny):
-            isValid = neighbours(mask, x, y, int(nx/2), int(ny/2))
-            # Get G statistic for this neighborhood
-            if np.sum(isValid) == isValid.size:
-                coords.append((x,y))
-            else:
-                continue
-    
-    delayed_results = [dask.delayed(Getis_per_neighborhood)(im, n, coord) for coord in coords[1:]]
-    with ProgressBar():
-        results = dask.compute(delayed_results, scheduler='processes')[0]
-    stats = stats.append(results, sort=False)
-    stats = stats[['x', 'y', 'nx', 'ny', 'Gi', 'Mean', 'Variance', 'SD', 'Z-Score', 'p-value', 'Sign']]
-    return stats
+# Parallel Getis: runs the tiled shared-memory backend (see Getis_tiled in EngineFunctions)
+# instead of shipping the whole image to a worker for every neighborhood
+def Getis_parallel(mask, maskedImage, nx, ny, workers=None, scheduler='processes', min_coverage=1.0):
+    return Getis_tiled(mask, maskedImage, nx, ny, workers=workers, scheduler=scheduler,
+                       min_coverage=min_coverage)
 
 
-def processedStats(stats, img, name):
-    direction = name.split("section")[1][2]
-    zs = stats.pivot('x','y','Z-Score').values
-    
-    # Break ROI down to DM, VM, DL, VL compartments of striatum
-    hmidline = img.shape[0]/2
-    vmidline = img.shape[1]/2
+# Z-score raster of a stats table: one row per unique x and one column per unique y (as stats.pivot), NaN where
+# there is no neighborhood. Returns the raster and its x and y coordinates.
+def statsRaster(stats, value='Z-Score'):
+    xs, xi = np.unique(stats['x'].to_numpy(), return_inverse=True)
+    ys, yi = np.unique(stats['y'].to_numpy(), return_inverse=True)
+    zs = np.full((len(xs), len(ys)), np.nan)
+    zs[xi, yi] = stats[value].to_numpy()
+    return zs, xs, ys
+
+
+
+# Count, Mean, SEM (SD with ddof=1 over sqrt(count)), Min and Max of every row and every column of a Z raster
+# (from statsRaster or Getis_dense), ignoring NaNs, in one vectorized pass per axis.
+# Returns two tables indexed by the row (DV) and column (ML) coordinates.
+def axisProfiles(zs, xs=None, ys=None):
+    profiles = []
+    for axis, index in ((1, xs), (0, ys)):
+        valid = ~np.isnan(zs)
+        count = np.sum(valid, axis=axis)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            total = np.sum(np.where(valid, zs, 0), axis=axis)
+            mean = total / count
+            sq = np.sum(np.where(valid, zs - np.expand_dims(mean, axis), 0)**2, axis=axis)
+            sem = np.sqrt(sq / (count - 1)) / np.sqrt(count)
+        zmin = np.min(np.where(valid, zs, np.inf), axis=axis)
+        zmax = np.max(np.where(valid, zs, -np.inf), axis=axis)
+        profile = pd.DataFrame({'Count':count, 'Mean':mean, 'SEM':sem,
+                                'Min':np.where(count > 0, zmin, np.nan), 'Max':np.where(count > 0, zmax, np.nan)},
+                               index=index if index is not None else np.arange(zs.shape[1 - axis]))
+        profiles.append(profile)
+    return profiles[0], profiles[1]
+
+
+
+# Quadrant of every neighborhood ('DM', 'VM', 'DL' or 'VL') split at the midlines of an image of the given shape;
+# neighborhoods lying exactly on a midline get ''. Medial/lateral sides depend on the hemisphere direction.
+def quadrantLabels(stats, shape, direction):
+    hmidline = shape[0]/2
+    vmidline = shape[1]/2
     if (direction == 'r') or (direction == 'R'):
-        DL = stats[(stats['y'] > vmidline) & (stats['x'] < hmidline)]
-        VL = stats[(stats['y'] > vmidline) & (stats['x'] > hmidline)]
-        DM = stats[(stats['y'] < vmidline) & (stats['x'] < hmidline)]
-        VM = stats[(stats['y'] < vmidline) & (stats['x'] > hmidline)]
+        names = {(True, True):'DL', (False, True):'VL', (True, False):'DM', (False, False):'VM'}
     elif (direction == 'l') or (direction == 'L'):
-        DM = stats[(stats['y'] > vmidline) & (stats['x'] < hmidline)]
-        VM = stats[(stats['y'] > vmidline) & (stats['x'] > hmidline)]
-        DL = stats[(stats['y'] < vmidline) & (stats['x'] < hmidline)]
-        VL = stats[(stats['y'] < vmidline) & (stats['x'] > hmidline)]
+        names = {(True, True):'DM', (False, True):'VM', (True, False):'DL', (False, False):'VL'}
     else:
         raise Exception("No proper direction specified. Proper directions include 'L' or 'l' for left; 'R' or 'r' for right")
-    
+    x = stats['x'].to_numpy()
+    y = stats['y'].to_numpy()
+    labels = np.full(len(stats), '', dtype=object)
+    for (dorsal, right), name in names.items():
+        rows = (x < hmidline) if dorsal else (x > hmidline)
+        cols = (y > vmidline) if right else (y < vmidline)
+        labels[rows & cols] = name
+    return labels
+
+
+
+# Region of every neighborhood from either an N x M grid over an image of the given shape (labels 0..N*M-1,
+# row-major) or an integer label map aligned with the image (label at each neighborhood center)
+def regionLabels(stats, shape=None, grid=None, labelMap=None):
+    x = stats['x'].to_numpy().astype(int)
+    y = stats['y'].to_numpy().astype(int)
+    if labelMap is not None:
+        return np.asarray(labelMap)[x, y]
+    if grid is None or shape is None:
+        raise Exception("regionLabels needs either a labelMap or both a grid and an image shape")
+    rows = np.minimum(x*grid[0] // shape[0], grid[0] - 1)
+    cols = np.minimum(y*grid[1] // shape[1], grid[1] - 1)
+    return rows*grid[1] + cols
+
+
+
+# Count, Mean, SD (ddof=0, as quadrantStds), SEM, Min and Max of the Z-scores in every region, in one grouped pass
+def regionSummary(stats, labels, value='Z-Score'):
+    grouped = stats[value].groupby(np.asarray(labels))
+    summary = grouped.agg(['count', 'mean', 'sem', 'min', 'max'])
+    summary.insert(2, 'std', grouped.std(ddof=0))
+    summary.columns = ['Count', 'Mean', 'SD', 'SEM', 'Min', 'Max']
+    summary.index.name = 'Region'
+    return summary
+
+
+
+def processedStats(stats, img, name):
+    direction = name.split("section")[1][2]
+    zs, xs, ys = statsRaster(stats)
+
+    # Break ROI down to DM, VM, DL, VL compartments of striatum
+    quadrant = quadrantLabels(stats, img.shape, direction)
+    DL = stats[quadrant == 'DL']
+    VL = stats[quadrant == 'VL']
+    DM = stats[quadrant == 'DM']
+    VM = stats[quadrant == 'VM']
+
     # Calculate Z-scores across the DV and ML axis separately
-    DVaxisZs = []
-    for i in np.sort(stats.x.unique()):
-        row = stats[stats['x']==i]['Z-Score']
-        DVaxisZs = np.append(DVaxisZs, np.sum(row)/len(row))
-    MLaxisZs = []
-    for i in np.sort(stats.y.unique()):
-        col = stats[stats['y']==i]['Z-Score']
-        MLaxisZs = np.append(MLaxisZs, np.sum(col)/len(col))
-    
+    DVprofile, MLprofile = axisProfiles(zs, xs, ys)
+    DVaxisZs = DVprofile['Mean'].to_numpy()
+    MLaxisZs = MLprofile['Mean'].to_numpy()
+
     # Calculate standard deviation of Z-scores for each quadrant
     quadrants = pd.DataFrame(['DM', 'VM', 'DL', 'VL'], columns=['Quadrant'])
     stds =pd.DataFrame([np.std(DM['Z-Score']), np.std(VM['Z-Score']), np.std(DL['Z-Score']), np.std(VL['Z-Score'])], columns=['SD'])
     quadrantStds = pd.concat([quadrants, stds], axis=1)
-    
+
     return direction, zs, DL, VL, DM, VM, MLaxisZs, DVaxisZs, quadrantStds
@@ -1,10 +1,19 @@
 import os
+import json
+import queue
+import threading
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
 import numpy as np
-import cv2
-from skimage.measure import block_reduce
 from AnalysisFunctions import *
 from ROIFunctions import *
-from PlottingFunctions import *
+from CacheFunctions import *
+from OutputFunctions import *
+from SummaryFunctions import *
+from FigureFunctions import *
+from InstrumentFunctions import *
+from UtilFunctions import writeJSON
 
 def loadImagesROIs(filesDir):
     imgDir = (filesDir + 'Images/')
@@ -29,74 +38,446 @@ def loadImagesROIs(filesDir):
 
 
 
-def BatchHotspot(filesDir, images, ROIs, threshold, downsample, nx, ny, saveDir=None):
+# Name shared by all outputs of one image at one neighborhood size
+def outputName(image, nx, ny):
+    return image.split('_img.')[0] + "_" + str(nx) + "x" + str(ny)
 
-    for i in range(len(images)):
-        os.chdir(filesDir)
-        # Load image and set names
-        img = cv2.imread('./Images/' + images[i])[:,:,0]
-        name = images[i].split('_img.')[0] + "_" + str(nx) + "x" + str(ny)
-        if downsample:
-            bitdepth = type(img)
-            img = block_reduce(img, (2,2), np.mean).astype(bitdepth)
-
-        # Remove saturated pixels
-        avgPixel = np.mean(img)
-        img[img > threshold] = avgPixel
-
-        # Use ROI to created masked image
-        mask = cv2.imread('./ROIs/' + ROIs[i])[:,:,0].astype(bool)
-        maskedImage = np.ma.array(img, mask = ~mask)
-        xrange = np.nanargmin(maskedImage, axis=1)
-        yrange = np.nanargmin(maskedImage, axis=0)
-        xmin = next((i for i, x in enumerate(xrange) if x), None)
-        xmax = len(xrange) - next((i for i, x in enumerate(np.flip(xrange, axis=0)) if x), None)
-        ymin = next((i for i, x in enumerate(yrange) if x), None)
-        ymax = len(yrange) - next((i for i, x in enumerate(np.flip(yrange, axis=0)) if x), None)
-        croppedImg = img[xmin:xmax,ymin:ymax]
-        mask = mask[xmin:xmax,ymin:ymax]
-        maskedImage = maskedImage[xmin:xmax,ymin:ymax]
-
-        # Run Getis analysis and save stats and necessary variables for visualizations
-        stats = Getis(mask, maskedImage, nx, ny)
+
+
+# Output folder of one image (saveDir, or a folder named after the image in filesDir) and its instrument: bound to
+# the image name and, with profile=True, also writing to a <name>_Profile.jsonl file next to the outputs.
+# Returns the output name, the folder, the instrument and the files written so far.
+def prepareOutputs(filesDir, image, nx, ny, saveDir=None, instrument=None, profile=True):
+    name = outputName(image, nx, ny)
+
+    # Create new folder for images
+    if saveDir is None:
+        path = os.path.join(filesDir, name)
+    else:
+        path = saveDir
+    os.makedirs(path, exist_ok=True)
+    outputs = []
+    instrument = (instrument or NULL_INSTRUMENT).bind(image=name)
+    if profile:
+        profilePath = os.path.join(path, name + PROFILE_SUFFIX)
+        instrument = instrument.bind(JSONLinesSink(profilePath, truncate=True))
+        outputs.append(profilePath)
+    return name, path, instrument, outputs
+
+
+# Decode stage: loads the image (8-bit, or at its own bit depth with native_depth=True) and ROI (a mask image or a
+# ROISet .json file, at the analyzed resolution)
+def loadInputs(filesDir, image, ROI, instrument=NULL_INSTRUMENT, native_depth=False):
+    with instrument.span('load') as span:
+        img = readImage(os.path.join(filesDir, 'Images', image), native_depth)
+        mask, bounds = loadROIMask(os.path.join(filesDir, 'ROIs', ROI))
+        span.count(pixels=img.size)
+    return img, mask, bounds
+
+
+# Compute stage: preprocessing, Getis (through `cache` when one is given) and the region partition used by the
+# summary. threshold is on the 8-bit scale and rescaled to the image's bit depth with native_depth=True.
+# Returns the cropped mask, the cropped masked image, the stats table, the direction and the regions.
+def analyzeInputs(img, mask, bounds, threshold, downsample, nx, ny, name, cache=None, instrument=NULL_INSTRUMENT,
+                  native_depth=False):
+    if native_depth:
+        threshold = depthThreshold(threshold, img.dtype)
+
+    # Downsample, remove saturated pixels and mask, on the ROI's bounding box only
+    with instrument.span('preprocess') as span:
+        mask, maskedImage = preprocessImage(img, mask, threshold, downsample, bounds)
+        span.count(pixels=maskedImage.size, roi_pixels=np.sum(mask))
+
+    # Run Getis analysis and save stats and necessary variables for visualizations
+    with instrument.span('getis', pixels=maskedImage.size) as span:
+        stats = cachedGetis(cache, Getis_integral, mask, maskedImage, nx, ny)
+        span.count(neighborhoods=len(stats))
+    with instrument.span('processedStats', neighborhoods=len(stats)):
         direction, zs, DL, VL, DM, VM, MLaxisZs, DVaxisZs, quadrantStds = processedStats(stats, maskedImage, name)
-        
-        # Create new folder for images
-        if saveDir is None:
-            path = "./" + name
-        else:
-            path = saveDir
+    return mask, maskedImage, stats, direction, {'DM':DM, 'VM':VM, 'DL':DL, 'VL':VL}
+
+
+# Write stage: saves the stats table as output_format ('csv', 'npz' or 'parquet'; the binary formats embed the run
+# parameters), the Z-score summary sidecar, the cropped masked image and the selected figures (drawn while holding
+# `lock`, if given, as pyplot is not thread-safe). Returns the paths of the files written.
+def writeOutputs(filesDir, image, ROI, path, name, analysis, threshold, downsample, nx, ny, output_format='csv',
+                 figures=None, figure_format='pdf', instrument=NULL_INSTRUMENT, lock=None):
+    mask, maskedImage, stats, direction, regions = analysis
+    outputs = []
+
+    # Save statistics in new folder
+    with instrument.span('writeStats', neighborhoods=len(stats)):
+        statsPath = os.path.join(path, name + STATS_SUFFIX + "." + output_format)
+        metadata = {'threshold':threshold, 'downsample':downsample, 'bit_depth':bitDepth(maskedImage.dtype), 'nx':nx,
+                    'ny':ny, 'direction':direction, 'source':os.path.join(filesDir, 'Images', image), 'roi':ROI,
+                    'roi_hash':roiHash(mask)}
+        metadata.update(nameMetadata(name))
+        writeStats(stats, statsPath, metadata)
+        outputs.append(statsPath)
+
+    # Save the Z-score distribution summary used for cohort analysis
+    with instrument.span('summary', neighborhoods=len(stats)):
+        summaryPath = os.path.join(path, name + SUMMARY_SUFFIX)
+        writeSummary(summarizeStats(stats, regions), summaryPath, metadata)
+        outputs.append(summaryPath)
+
+    # Save the cropped image the figures are drawn from, then create and save visualizations in new folder
+    with instrument.span('writeImage', pixels=maskedImage.size):
+        imagePath = os.path.join(path, name + IMAGE_SUFFIX)
+        writeFigureImage(maskedImage, imagePath)
+        outputs.append(imagePath)
+    with lock or nullcontext():
+        outputs += saveFigures(stats, maskedImage, name, path, figures, figure_format, instrument=instrument)
+    return outputs
+
 
+
+# Runs the full hotspot analysis for one image/ROI pair and saves the figures and stats under explicit paths
+# (saveDir, or a folder named after the image in filesDir). Getis results are looked up in and stored to `cache`
+# (a GetisCache) when one is given. The stats table is saved as output_format ('csv', 'npz' or 'parquet'; the
+# binary formats embed the run parameters) alongside a Z-score summary sidecar and the cropped masked image, from
+# which the selected figures (names from FIGURES, all by default) are drawn as figure_format ('pdf', 'png' or 'none'
+# to leave them to exportFigures). Every stage runs in a span of `instrument` (an Instrument, none by default);
+# with profile=True the spans are also written to a <name>_Profile.jsonl file next to the outputs.
+# Images are read at 8 bits per pixel; native_depth=True reads them at their own bit depth and rescales threshold
+# (given on the 8-bit scale) to match. The bit depth analyzed is saved with the stats and summary.
+# Returns the paths of the files written.
+def processImage(filesDir, image, ROI, threshold, downsample, nx, ny, saveDir=None, cache=None,
+                 output_format='csv', figures=None, figure_format='pdf', instrument=None, profile=True,
+                 native_depth=False):
+    name, path, instrument, outputs = prepareOutputs(filesDir, image, nx, ny, saveDir, instrument, profile)
+    with instrument.span('image') as total:
+        img, mask, bounds = loadInputs(filesDir, image, ROI, instrument, native_depth)
+        analysis = analyzeInputs(img, mask, bounds, threshold, downsample, nx, ny, name, cache, instrument,
+                                 native_depth)
+        del img
+        total.count(pixels=analysis[1].size, neighborhoods=len(analysis[2]))
+        outputs += writeOutputs(filesDir, image, ROI, path, name, analysis, threshold, downsample, nx, ny,
+                                output_format, figures, figure_format, instrument)
+    return outputs
+
+
+
+# Runs processImage over all image/ROI pairs in turn. Stage spans go to `instrument` (e.g.
+# Instrument(ProgressReporter(len(images))) for a progress bar) and, with profile=True, to per-image profiles.
+def BatchHotspot(filesDir, images, ROIs, threshold, downsample, nx, ny, saveDir=None, cache=None,
+                 output_format='csv', figures=None, figure_format='pdf', instrument=None, profile=True,
+                 native_depth=False):
+    for i in range(len(images)):
+        processImage(filesDir, images[i], ROIs[i], threshold, downsample, nx, ny, saveDir, cache, output_format,
+                     figures, figure_format, instrument, profile, native_depth)
+
+
+
+# Puts an item on a bounded queue, waiting for room unless the pipeline is stopped
+def putWhile(q, item, stop):
+    while not stop.is_set():
         try:
-            os.mkdir(path)
-        except OSError:
-            print ("Creation of the directory %s failed" % path)
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+# Streaming BatchHotspot: `readers` I/O threads decode the next images while the calling thread runs the compute
+# stage, and `writers` threads save stats, summaries and figures (figures one at a time) while the next image is
+# analyzed. The stages are connected by queues holding at most `depth` images each, so a slow stage holds the others
+# back and at most readers + writers + 2*depth + 1 images are in memory. Outputs, spans and profiles are the same as
+# BatchHotspot's, except that the 'image' span of every image is the total of its stage spans (see StageTotals), as
+# its stages run on different threads. Returns a table with the status ('done' or 'failed') and the files of every image.
+def BatchHotspot_pipeline(filesDir, images, ROIs, threshold, downsample, nx, ny, saveDir=None, cache=None,
+                          output_format='csv', figures=None, figure_format='pdf', instrument=None, profile=True,
+                          native_depth=False, readers=2, writers=1, depth=2):
+    jobs = queue.Queue()
+    for image, ROI in zip(images, ROIs):
+        jobs.put((image, ROI))
+    decoded = queue.Queue(maxsize=depth)
+    analyzed = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    figureLock = threading.Lock()
+    status = []
+
+    # Each image travels as [image, ROI, name, path, instrument, outputs, stage totals, data, error]
+    def read():
+        while not stop.is_set():
+            try:
+                image, ROI = jobs.get_nowait()
+            except queue.Empty:
+                break
+            item = [image, ROI, None, None, None, [], None, None, None]
+            try:
+                item[2:6] = prepareOutputs(filesDir, image, nx, ny, saveDir, instrument, profile)
+                item[6] = StageTotals(item[4])
+                item[4] = item[4].bind(item[6])
+                item[7] = loadInputs(filesDir, image, ROI, item[4], native_depth)
+            except Exception as e:
+                item[8] = e
+            if not putWhile(decoded, item, stop):
+                return
+        putWhile(decoded, None, stop)
+
+    def write():
+        while True:
+            item = analyzed.get()
+            if item is None:
+                return
+            image, ROI, name, path, imageInstrument, outputs, total, analysis, error = item
+            if error is None:
+                try:
+                    outputs += writeOutputs(filesDir, image, ROI, path, name, analysis, threshold, downsample, nx, ny,
+                                            output_format, figures, figure_format, imageInstrument, figureLock)
+                except Exception as e:
+                    error = e
+            if total is not None:
+                total.emit('image', error)
+            if error is not None:
+                print("Hotspot analysis of %s failed: %r" % (image, error))
+            status.append({'Image':image, 'Status':'done' if error is None else 'failed',
+                           'Error':None if error is None else repr(error), 'Outputs':outputs})
+
+    threads = [threading.Thread(target=read, daemon=True) for _ in range(readers)]
+    threads += [threading.Thread(target=write, daemon=True) for _ in range(writers)]
+    for thread in threads:
+        thread.start()
+    try:
+        finished = 0
+        while finished < readers:
+            item = decoded.get()
+            if item is None:
+                finished += 1
+                continue
+            if item[8] is None:
+                img, mask, bounds = item[7]
+                try:
+                    item[7] = analyzeInputs(img, mask, bounds, threshold, downsample, nx, ny, item[2], cache,
+                                            item[4], native_depth)
+                    item[6].count(pixels=item[7][1].size, neighborhoods=len(item[7][2]))
+                except Exception as e:
+                    item[7], item[8] = None, e
+                del img, mask, bounds
+            analyzed.put(item)
+    finally:
+        # Writers finish the images already analyzed; readers stop decoding new ones
+        stop.set()
+        for _ in range(writers):
+            analyzed.put(None)
+        for thread in threads:
+            thread.join()
+    return pd.DataFrame(status, columns=['Image', 'Status', 'Error', 'Outputs'])
+
+
+
+# Manifest of completed batch outputs: {output name: {'params', 'sources', 'outputs'}}
+MANIFEST_NAME = 'hotspot_manifest.json'
+
+
+def readManifest(manifestPath):
+    if not os.path.exists(manifestPath):
+        return {}
+    with open(manifestPath) as f:
+        return json.load(f)
+
+
+# Writes the manifest atomically, so a crash mid-write never leaves a truncated file behind
+def writeManifest(manifest, manifestPath):
+    writeJSON(manifest, manifestPath)
+
+
+# Size and modification time of a file, used to notice when an input has changed since it was processed
+def fileFingerprint(path):
+    info = os.stat(path)
+    return [info.st_size, info.st_mtime_ns]
+
+
+# Parameters a manifest entry was produced with; outputs made with other parameters are redone
+def manifestParams(threshold, downsample, nx, ny, saveDir, output_format, native_depth=False):
+    return {'threshold':float(threshold), 'downsample':downsampleFactor(downsample), 'nx':int(nx), 'ny':int(ny),
+            'saveDir':saveDir, 'output_format':output_format, 'native_depth':bool(native_depth)}
+
+
+# Fingerprints of the image and ROI files an output is made from
+def imageSources(filesDir, image, ROI):
+    return {'image':fileFingerprint(os.path.join(filesDir, 'Images', image)),
+            'roi':fileFingerprint(os.path.join(filesDir, 'ROIs', ROI))}
+
+
+# Manifest entry of finished outputs, with the bit depth the image was analyzed at (from its summary sidecar)
+def manifestEntry(params, sources, outputs):
+    entry = {'params':params, 'sources':sources, 'outputs':{path:os.path.getsize(path) for path in outputs}}
+    for path in outputs:
+        if path.endswith(SUMMARY_SUFFIX):
+            entry['bit_depth'] = readSummary(path)['metadata'].get('bit_depth')
+    return entry
+
+
+# Whether a manifest entry was produced from the same inputs and parameters and all its outputs are still on disk
+def isComplete(entry, params, sources):
+    return (entry.get('params') == params and entry.get('sources') == sources
+            and all(os.path.exists(path) and os.path.getsize(path) == size > 0
+                    for path, size in entry.get('outputs', {}).items()))
+
+
+# Pool worker setup: headless plotting and an optional cap on the worker's address space, so that an
+# oversized image fails with a MemoryError instead of taking the node down
+def initBatchWorker(max_memory):
+    import matplotlib
+    matplotlib.use('Agg')
+    if max_memory is not None:
+        import resource
+        resource.setrlimit(resource.RLIMIT_AS, (int(max_memory), int(max_memory)))
+
+
+
+# Times a job in flight when a worker died is rerun before it is recorded as failed
+POOL_RETRIES = 2
+
+
+# Process pool of batch workers (see initBatchWorker) that outlives its workers. A worker that dies (e.g. killed for
+# memory) takes every job in flight down with it: the pool is then rebuilt and those jobs are rerun one at a time
+# (at most `retries` times each), so only a job that crashes a worker on its own is failed. Jobs are queued with
+# add(key, job, func, *args), `key` identifying the job across reruns, and collect() returns the finished ones.
+class WorkerPool:
+
+    def __init__(self, workers=None, max_memory=None, retries=POOL_RETRIES):
+        self.workers = workers or os.cpu_count()
+        self.max_memory = max_memory
+        self.retries = retries
+        self.pool = None
+        self.queue = []
+        self.running = {}
+        self.tries = {}
+
+    def executor(self):
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=initBatchWorker,
+                                            initargs=(self.max_memory,))
+        return self.pool
+
+    def add(self, key, job, func, *args):
+        self.queue.append((key, job, func, args))
+
+    # Jobs queued or in flight
+    def jobs(self):
+        return [item[1] for item in self.queue + list(self.running.values())]
+
+    # Keeps `workers` jobs in flight; jobs rerun after a worker died run alone
+    def submit(self):
+        while self.queue and len(self.running) < self.workers:
+            if (self.queue[0][0] in self.tries and self.running) or \
+                    any(item[0] in self.tries for item in self.running.values()):
+                break
+            item = self.queue.pop(0)
+            self.running[self.executor().submit(item[2], *item[3])] = item
+
+    # Waits for a job in flight to finish, for at most `timeout` seconds
+    def wait(self, timeout=None):
+        if self.running:
+            wait(list(self.running), timeout=timeout, return_when=FIRST_COMPLETED)
+
+    # Finished jobs as (job, result, error), with the jobs lost with a dead worker queued again
+    def collect(self):
+        finished = [f for f in self.running if f.done()]
+        broken = any(isinstance(f.exception(), BrokenProcessPool) for f in finished)
+        if broken:
+            # Every job still in flight fails with the pool
+            wait(list(self.running))
+            finished = list(self.running)
+        results = []
+        rerun = []
+        for future in finished:
+            item = self.running.pop(future)
+            key, job = item[:2]
+            tries = self.tries.pop(key, 0)
+            try:
+                results.append((job, future.result(), None))
+            except BrokenProcessPool as e:
+                if len(finished) > 1 and tries < self.retries:
+                    self.tries[key] = tries + 1
+                    rerun.append(item)
+                else:
+                    results.append((job, None, e))
+            except Exception as e:
+                results.append((job, None, e))
+        if broken:
+            self.shutdown(wait=False)
+            self.queue[:0] = rerun
+        return results
+
+    def shutdown(self, wait=True):
+        if self.pool is not None:
+            self.pool.shutdown(wait=wait)
+            self.pool = None
+
+
+
+# Parallel, resumable BatchHotspot: images are fanned out to `workers` processes (each capped at max_memory bytes
+# if given), outputs are written to explicit paths, and every finished image is recorded in a JSON manifest
+# (by default hotspot_manifest.json in saveDir or filesDir). A re-run skips images whose outputs are complete and
+# were made from unchanged inputs with the same parameters. Images lost with a worker that died are rerun on a
+# fresh pool (see WorkerPool), so one crashing image does not fail the rest of the batch.
+# With figure_workers set, figures are taken out of the compute workers and drawn from the saved stats in a
+# separate pool of figure_workers processes while the next images are analyzed; an image is recorded as soon as both
+# stages are done. figure_format='none' skips figures altogether (see exportFiguresBatch to draw them later).
+# With profile=True every worker writes the stage spans of its image to <name>_Profile.jsonl (see readProfiles).
+# Returns a table with the status ('done', 'skipped' or 'failed') of every image.
+def BatchHotspot_pool(filesDir, images, ROIs, threshold, downsample, nx, ny, saveDir=None,
+                      workers=None, max_memory=None, manifestPath=None, cache=None, output_format='csv',
+                      figures=None, figure_format='pdf', figure_workers=None, profile=True, native_depth=False):
+    if manifestPath is None:
+        manifestPath = os.path.join(saveDir if saveDir is not None else filesDir, MANIFEST_NAME)
+    manifest = readManifest(manifestPath)
+    params = manifestParams(threshold, downsample, nx, ny, saveDir, output_format, native_depth)
+
+    status = []
+    pending = []
+    for image, ROI in zip(images, ROIs):
+        sources = imageSources(filesDir, image, ROI)
+        name = outputName(image, nx, ny)
+        if name in manifest and isComplete(manifest[name], params, sources):
+            status.append({'Image':image, 'Status':'skipped', 'Error':None})
         else:
-            print ("Successfully created the directory %s " % path)
-        os.chdir(path)
-        
-        # Create and save visualizations in new folder
-        Heatmap = HeatmapPlot(zs)
-        Heatmap.savefig(((name + "_HeatmapPlot.pdf")), bbox_inches="tight")
-        plt.close(Heatmap)
-        DV_ML = DV_ML_Plot(stats, zs, MLaxisZs, DVaxisZs, direction)
-        DV_ML.savefig(((name + "_DV_ML_Plot.pdf")), bbox_inches="tight")
-        plt.close(DV_ML)
-        Quadrant = QuadrantPlot(stats, maskedImage, DL, VL, DM, VM)
-        Quadrant.savefig(((name + "_QuadrantPlot.pdf")), bbox_inches="tight")
-        plt.close(Quadrant)
-        Gstat = statsPlot(stats, maskedImage, "Gstat")
-        Gstat.savefig(((name + "_GstatPlot.pdf")), bbox_inches="tight")
-        plt.close(Gstat)
-        Hotspot = statsPlot(stats, maskedImage, "Hotspot")
-        Hotspot.savefig(((name + "_HotspotPlot.pdf")), bbox_inches="tight")
-        plt.close(Hotspot)
-        Zdistribution = ZdistributionPlot(stats, name)
-        Zdistribution.savefig(((name + "_ZdistributionPlot.pdf")), bbox_inches="tight")
-        plt.close(Zdistribution)
-        
-        # Save statistics in new folder
-        exportStats = stats.to_csv((name + "_GetisOrdStats.csv"))
-        
-        # Delete current variables from memory
-        del name, direction, avgPixel, img, mask, maskedImage, xrange, yrange, xmin, xmax, ymin, ymax, croppedImg, exportStats, Heatmap, DV_ML, Quadrant, Gstat, Hotspot, Zdistribution
+            pending.append((image, ROI, name, sources))
+
+    def record(image, name, sources, outputs):
+        manifest[name] = manifestEntry(params, sources, outputs)
+        writeManifest(manifest, manifestPath)
+        status.append({'Image':image, 'Status':'done', 'Error':None})
+
+    def failed(image, stage, e):
+        print("%s of %s failed: %r" % (stage, image, e))
+        status.append({'Image':image, 'Status':'failed', 'Error':repr(e)})
+
+    deferred = figure_workers is not None and figure_format != 'none'
+    figurePool = ProcessPoolExecutor(max_workers=figure_workers, initializer=initFigureWorker) if deferred else None
+    figureFutures = {}
+    pool = WorkerPool(workers, max_memory)
+    for image, ROI, name, sources in pending:
+        pool.add(name, (image, name, sources), processImage, filesDir, image, ROI, threshold, downsample, nx, ny,
+                 saveDir, cache, output_format, figures, 'none' if deferred else figure_format, None, profile,
+                 native_depth)
+    try:
+        while pool.queue or pool.running or figureFutures:
+            pool.submit()
+            wait(list(pool.running) + list(figureFutures), return_when=FIRST_COMPLETED)
+            for (image, name, sources), outputs, e in pool.collect():
+                if e is not None:
+                    failed(image, "Hotspot analysis", e)
+                    continue
+                if deferred:
+                    path = os.path.dirname(outputs[0])
+                    figureFutures[figurePool.submit(exportFigures, path, name, figures, figure_format)] = \
+                        (image, name, sources, outputs)
+                else:
+                    record(image, name, sources, outputs)
+            for future in [f for f in figureFutures if f.done()]:
+                image, name, sources, outputs = figureFutures.pop(future)
+                try:
+                    record(image, name, sources, outputs + future.result())
+                except Exception as e:
+                    failed(image, "Figure export", e)
+    finally:
+        pool.shutdown()
+        if figurePool is not None:
+            figurePool.shutdown()
+    return pd.DataFrame(status, columns=['Image', 'Status', 'Error'])
@@ -0,0 +1,274 @@
+# Benchmarks with synthetic hotspot images for Getis Ord Hotspot Analysis
+import os
+import io
+import sys
+import json
+import time
+import socket
+import argparse
+import tempfile
+import tracemalloc
+import subprocess
+import numpy as np
+import pandas as pd
+from UtilFunctions import gitCommit
+
+BENCHMARK_SIZES = [1024, 2048, 4096]
+BENCHMARK_NEIGHBORHOODS = [20]
+BENCHMARK_WORKERS = [1, 4]
+BENCHMARK_DTYPES = ['uint8', 'uint16']
+HISTORY_PATH = "hotspot_benchmarks.jsonl"
+# Import budget of the compute-only path (what every pool worker loads): cold-start seconds and peak RSS in MB,
+# and the optional dependencies it must not load
+IMPORT_MODULES = ['EngineFunctions', 'BatchFunctions', 'RunFunctions']
+IMPORT_BUDGET = {'seconds':1.5, 'rss_mb':200}
+HEAVY_MODULES = ['matplotlib', 'seaborn', 'holoviews', 'dask', 'czifile', 'tifffile', 'scipy', 'tqdm', 'skimage']
+
+
+# Seeded synthetic section: a noisy background with a smooth gradient, `blobs` Gaussian hotspots of known center,
+# radius and amplitude, and an elliptical ROI covering most of the frame. Returns the image, the ROI mask and a
+# table of the blobs (in pixel coordinates x = row, y = column).
+def syntheticImage(size, dtype='uint8', blobs=8, blob_radius=(0.01, 0.04), amplitude=(0.3, 0.6), background=0.25,
+                   gradient=0.1, noise=0.08, seed=0):
+    rng = np.random.default_rng(seed)
+    H, W = (size, size) if np.isscalar(size) else size
+    top = np.iinfo(dtype).max if np.issubdtype(np.dtype(dtype), np.integer) else 1.0
+    rows = np.linspace(0, 1, H, dtype=np.float32)[:, None]
+    cols = np.linspace(0, 1, W, dtype=np.float32)[None, :]
+    img = background + gradient*(rows - 0.5) + np.zeros((1, W), dtype=np.float32)
+    img = img + noise*rng.standard_normal((H, W), dtype=np.float32)
+
+    table = pd.DataFrame({'x':rng.uniform(0.2, 0.8, blobs)*H, 'y':rng.uniform(0.2, 0.8, blobs)*W,
+                          'radius':rng.uniform(*blob_radius, blobs)*min(H, W),
+                          'amplitude':rng.uniform(*amplitude, blobs)})
+    for blob in table.itertuples():
+        r0, r1 = int(max(blob.x - 4*blob.radius, 0)), int(min(blob.x + 4*blob.radius + 1, H))
+        c0, c1 = int(max(blob.y - 4*blob.radius, 0)), int(min(blob.y + 4*blob.radius + 1, W))
+        d2 = (rows[r0:r1]*(H - 1) - blob.x)**2 + (cols[:, c0:c1]*(W - 1) - blob.y)**2
+        img[r0:r1, c0:c1] += blob.amplitude*np.exp(-d2 / (2*blob.radius**2))
+    img = (np.clip(img, 0, 1)*top).astype(dtype)
+
+    mask = ((rows - 0.5)**2/0.45**2 + (cols - 0.5)**2/0.4**2) < 1
+    return img, mask, table
+
+
+
+# Wall time and peak traced Python/numpy memory of func(*args, **kwargs); the best of `repeat` runs is kept.
+# Memory allocated in worker processes is not traced.
+def measure(func, *args, repeat=1, **kwargs):
+    seconds = []
+    peaks = []
+    for _ in range(repeat):
+        tracemalloc.start()
+        start = time.perf_counter()
+        func(*args, **kwargs)
+        seconds.append(time.perf_counter() - start)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return min(seconds), min(peaks) / 2**20
+
+
+
+# Benchmarked steps. Each takes the ROI mask, the masked image, nx/ny, the worker count and a scratch folder.
+def benchGetis(mask, maskedImage, nx, ny, workers, tmpdir):
+    from AnalysisFunctions import Getis
+    return Getis(mask, maskedImage, nx, ny)
+
+
+def benchGetisIntegral(mask, maskedImage, nx, ny, workers, tmpdir):
+    from EngineFunctions import Getis_integral
+    return Getis_integral(mask, maskedImage, nx, ny)
+
+
+def benchGetisParallel(mask, maskedImage, nx, ny, workers, tmpdir):
+    from AnalysisFunctions import Getis_parallel
+    return Getis_parallel(mask, maskedImage, nx, ny, workers=workers)
+
+
+def benchProcessedStats(mask, maskedImage, nx, ny, workers, tmpdir, stats=None):
+    from AnalysisFunctions import processedStats
+    return processedStats(stats, maskedImage, "Bench_sectionB1R")
+
+
+def benchStatsPlot(mask, maskedImage, nx, ny, workers, tmpdir, stats=None):
+    import matplotlib.pyplot as plt
+    from PlottingFunctions import statsPlot
+    fig = statsPlot(stats, maskedImage, "Hotspot")
+    fig.savefig(io.BytesIO(), format='pdf', bbox_inches="tight")
+    plt.close(fig)
+
+
+def benchBatchHotspot(mask, maskedImage, nx, ny, workers, tmpdir):
+    import cv2
+    from BatchFunctions import BatchHotspot
+    filesDir = os.path.join(tmpdir, 'files') + os.sep
+    os.makedirs(filesDir + 'Images', exist_ok=True)
+    os.makedirs(filesDir + 'ROIs', exist_ok=True)
+    cv2.imwrite(filesDir + 'Images/Bench_sectionB1R_img.tif', np.ma.getdata(maskedImage))
+    cv2.imwrite(filesDir + 'ROIs/Bench_sectionB1R_ROI.tif', mask.astype(np.uint8)*255)
+    BatchHotspot(filesDir, ['Bench_sectionB1R_img.tif'], ['Bench_sectionB1R_ROI.tif'],
+                 np.iinfo(maskedImage.dtype).max, False, nx, ny, saveDir=os.path.join(tmpdir, 'out'))
+
+
+# name: (function, uses workers, needs a stats table, largest image side it is run on)
+BENCHMARKS = {'Getis': (benchGetis, False, False, 1024),
+              'Getis_integral': (benchGetisIntegral, False, False, None),
+              'Getis_parallel': (benchGetisParallel, True, False, None),
+              'processedStats': (benchProcessedStats, False, True, None),
+              'statsPlot': (benchStatsPlot, False, True, 4096),
+              'BatchHotspot': (benchBatchHotspot, False, False, 8192)}
+
+
+
+# Cold-start cost of importing `module` in a fresh interpreter: seconds, peak RSS in MB (of the whole process) and
+# the HEAVY_MODULES it pulled in
+def importCost(module):
+    script = ("import sys, time, json, resource; sys.path.insert(0, %r); start = time.perf_counter(); import %s; "
+              "seconds = time.perf_counter() - start; rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss; "
+              "print(json.dumps({'seconds':seconds, 'rss_mb':rss / (2**20 if sys.platform == 'darwin' else 2**10), "
+              "'heavy':[m for m in %r if m in sys.modules]}))"
+              % (os.path.dirname(os.path.abspath(__file__)), module, HEAVY_MODULES))
+    result = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True)
+    if result.returncode != 0:
+        raise Exception("Importing " + module + " failed:\n" + result.stderr)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+# Import budget check: the best of `repeat` cold starts of every module against `budget`. A module is over budget
+# when it is slower or larger than allowed or loads any of the HEAVY_MODULES.
+def importBudget(modules=IMPORT_MODULES, budget=IMPORT_BUDGET, repeat=3):
+    rows = []
+    for module in modules:
+        costs = [importCost(module) for _ in range(repeat)]
+        row = {'module':module, 'seconds':min(c['seconds'] for c in costs),
+               'rss_mb':min(c['rss_mb'] for c in costs), 'heavy':costs[-1]['heavy']}
+        row['Over budget'] = (row['seconds'] > budget['seconds'] or row['rss_mb'] > budget['rss_mb']
+                              or bool(row['heavy']))
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+
+# Runs every selected benchmark over all sizes, dtypes, neighborhood sizes and (for parallel steps) worker counts,
+# appending one JSON line per measurement to historyPath (skipped when None). Returns the measurements.
+def runBenchmarks(functions=None, sizes=BENCHMARK_SIZES, neighborhoods=BENCHMARK_NEIGHBORHOODS,
+                  workers=BENCHMARK_WORKERS, dtypes=BENCHMARK_DTYPES, repeat=1, seed=0, historyPath=HISTORY_PATH,
+                  run=None):
+    import matplotlib
+    matplotlib.use('Agg')
+    from EngineFunctions import Getis_integral
+    functions = list(BENCHMARKS) if functions is None else list(functions)
+    run = run or time.strftime("%Y%m%d-%H%M%S")
+    context = {'run':run, 'commit':gitCommit(), 'host':socket.gethostname(), 'python':sys.version.split()[0],
+               'numpy':np.__version__, 'pandas':pd.__version__}
+    results = []
+    for size in sizes:
+        for dtype in dtypes:
+            img, mask, blobs = syntheticImage(size, dtype, seed=seed)
+            maskedImage = np.ma.array(img, mask=~mask)
+            for n in neighborhoods:
+                stats = Getis_integral(mask, maskedImage, n, n)
+                for name in functions:
+                    func, parallel, needsStats, limit = BENCHMARKS[name]
+                    if limit is not None and size > limit:
+                        continue
+                    kwargs = {'stats':stats} if needsStats else {}
+                    for w in (workers if parallel else [None]):
+                        result = dict(context, function=name, size=int(size), dtype=dtype, nx=int(n), ny=int(n),
+                                      workers=w, seconds=None, peak_mb=None, error=None, timestamp=time.time())
+                        try:
+                            with tempfile.TemporaryDirectory() as tmpdir:
+                                result['seconds'], result['peak_mb'] = measure(func, mask, maskedImage, n, n, w,
+                                                                               tmpdir, repeat=repeat, **kwargs)
+                        except Exception as e:
+                            if tracemalloc.is_tracing():
+                                tracemalloc.stop()
+                            result['error'] = repr(e)
+                            print("%s %dx%d %s %dx%d workers=%s failed: %r" % (name, size, size, dtype, n, n, w, e))
+                        else:
+                            print("%s %dx%d %s %dx%d workers=%s: %.3f s, %.1f MB"
+                                  % (name, size, size, dtype, n, n, w, result['seconds'], result['peak_mb']))
+                        results.append(result)
+                        if historyPath is not None:
+                            with open(historyPath, 'a') as f:
+                                f.write(json.dumps(result) + "\n")
+    return pd.DataFrame(results)
+
+
+
+def readHistory(historyPath=HISTORY_PATH):
+    with open(historyPath) as f:
+        return pd.DataFrame([json.loads(line) for line in f if line.strip()])
+
+
+
+# Compares two runs of a benchmark history measurement by measurement. A measurement regresses when its time or
+# peak memory grows by more than `tolerance` (a fraction) from the base run to the new run; slowdowns of less than
+# min_seconds are treated as timing noise. Runs default to the second-to-last and last run in the history.
+def compareRuns(history, base=None, new=None, tolerance=0.1, min_seconds=0.05):
+    runs = list(dict.fromkeys(history['run']))
+    if len(runs) < 2 and (base is None or new is None):
+        raise Exception("The benchmark history needs at least two runs to compare.")
+    base = runs[-2] if base is None else base
+    new = runs[-1] if new is None else new
+    keys = ['function', 'size', 'dtype', 'nx', 'ny', 'workers']
+    history = history.assign(workers=history['workers'].fillna(0).astype(int))
+    if 'error' in history:
+        history = history[history['error'].isna()]
+    comparison = pd.merge(history[history['run'] == base][keys + ['seconds', 'peak_mb']],
+                          history[history['run'] == new][keys + ['seconds', 'peak_mb']],
+                          on=keys, suffixes=(' base', ' new'))
+    comparison['time ratio'] = comparison['seconds new'] / comparison['seconds base']
+    comparison['memory ratio'] = comparison['peak_mb new'] / comparison['peak_mb base']
+    slower = comparison['seconds new'] - comparison['seconds base'] > min_seconds
+    comparison['Regression'] = ((slower & (comparison['time ratio'] > 1 + tolerance))
+                                | (comparison['memory ratio'] > 1 + tolerance))
+    return comparison
+
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks for Getis Ord Hotspot Analysis")
+    commands = parser.add_subparsers(dest='command', required=True)
+    run = commands.add_parser('run', help="run benchmarks and append them to the history")
+    run.add_argument('--functions', nargs='+', choices=list(BENCHMARKS))
+    run.add_argument('--sizes', nargs='+', type=int, default=BENCHMARK_SIZES)
+    run.add_argument('--neighborhoods', nargs='+', type=int, default=BENCHMARK_NEIGHBORHOODS)
+    run.add_argument('--workers', nargs='+', type=int, default=BENCHMARK_WORKERS)
+    run.add_argument('--dtypes', nargs='+', choices=['uint8', 'uint16'], default=BENCHMARK_DTYPES)
+    run.add_argument('--repeat', type=int, default=1)
+    run.add_argument('--seed', type=int, default=0)
+    run.add_argument('--run', help="name of this run (default: a timestamp)")
+    run.add_argument('--history', default=HISTORY_PATH)
+    compare = commands.add_parser('compare', help="compare two runs of the history and flag regressions")
+    compare.add_argument('base', nargs='?')
+    compare.add_argument('new', nargs='?')
+    compare.add_argument('--tolerance', type=float, default=0.1)
+    compare.add_argument('--min-seconds', type=float, default=0.05)
+    compare.add_argument('--history', default=HISTORY_PATH)
+    imports = commands.add_parser('imports', help="check the cold-start import budget of the compute-only path")
+    imports.add_argument('--modules', nargs='+', default=IMPORT_MODULES)
+    imports.add_argument('--seconds', type=float, default=IMPORT_BUDGET['seconds'])
+    imports.add_argument('--rss-mb', type=float, default=IMPORT_BUDGET['rss_mb'])
+    imports.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        runBenchmarks(args.functions, args.sizes, args.neighborhoods, args.workers, args.dtypes, args.repeat,
+                      args.seed, args.history, args.run)
+        return 0
+    if args.command == 'imports':
+        costs = importBudget(args.modules, {'seconds':args.seconds, 'rss_mb':args.rss_mb}, args.repeat)
+        print(costs.to_string(index=False))
+        return 1 if costs['Over budget'].any() else 0
+    comparison = compareRuns(readHistory(args.history), args.base, args.new, args.tolerance, args.min_seconds)
+    with pd.option_context('display.width', 200, 'display.max_columns', 20):
+        print(comparison)
+    regressions = int(comparison['Regression'].sum())
+    print("%d regression(s) out of %d measurements" % (regressions, len(comparison)))
+    return 1 if regressions else 0
+
+
+
+if __name__ == '__main__':
+    sys.exit(main())
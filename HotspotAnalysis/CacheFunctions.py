@@ -0,0 +1,116 @@
+# Content-addressed cache of Getis results for Getis Ord Hotspot Analysis
+import os
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+
+# Keyword arguments that change how a result is computed but not the result itself
+EXECUTION_PARAMS = {'workers', 'scheduler', 'tmpdir', 'tile', 'memory_budget'}
+
+
+# Feeds an array's dtype, shape and raw bytes into a hash, a band of rows at a time to avoid a full copy
+def hashArray(h, arr, band=1024):
+    arr = np.asarray(arr)
+    h.update(str((arr.dtype.str, arr.shape)).encode())
+    for start in range(0, max(arr.shape[0], 1), band):
+        h.update(np.ascontiguousarray(arr[start:start+band]).data)
+
+
+
+# Cache key of a Getis run: a hash of the function name, the image pixels and mask, the ROI mask and all
+# parameters that affect the result
+def getisKey(func, mask, maskedImage, **params):
+    h = hashlib.blake2b(digest_size=20)
+    h.update(func.encode())
+    hashArray(h, np.ma.getdata(maskedImage))
+    hashArray(h, np.ma.getmaskarray(maskedImage))
+    hashArray(h, np.asarray(mask, dtype=bool))
+    params = {k:v for k, v in params.items() if k not in EXECUTION_PARAMS}
+    h.update(json.dumps(params, sort_keys=True, default=str).encode())
+    return h.hexdigest()
+
+
+
+# Size-bounded on-disk store of stats tables keyed by getisKey. Every hit refreshes the entry's modification time,
+# and when the store grows past max_bytes the least recently used entries are evicted first.
+# Only the directory and the size bound are kept on the object, so it can be passed to pool workers.
+class GetisCache:
+
+    def __init__(self, cacheDir, max_bytes=2**30):
+        self.cacheDir = cacheDir
+        self.max_bytes = max_bytes
+        os.makedirs(cacheDir, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.cacheDir, key + '.pkl')
+
+    def entries(self):
+        return [os.path.join(self.cacheDir, f) for f in os.listdir(self.cacheDir) if f.endswith('.pkl')]
+
+    def size(self):
+        return sum(os.path.getsize(path) for path in self.entries())
+
+    def __len__(self):
+        return len(self.entries())
+
+    def __contains__(self, key):
+        return os.path.exists(self.path(key))
+
+    # Returns the stored stats table, or None on a miss
+    def get(self, key):
+        try:
+            stats = pd.read_pickle(self.path(key))
+            os.utime(self.path(key))
+        except (FileNotFoundError, EOFError):
+            return None
+        return stats
+
+    def put(self, key, stats):
+        tmpPath = self.path(key) + '.{}.tmp'.format(os.getpid())
+        stats.to_pickle(tmpPath)
+        os.replace(tmpPath, self.path(key))
+        self.evict()
+
+    # Removes least recently used entries until the store fits in max_bytes
+    def evict(self):
+        entries = []
+        for path in self.entries():
+            try:
+                info = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((info.st_mtime_ns, info.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self.remove(path)
+            total -= size
+
+    # Drops one entry, or every entry when key is None
+    def invalidate(self, key=None):
+        paths = self.entries() if key is None else [self.path(key)]
+        for path in paths:
+            self.remove(path)
+
+    def remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+
+# Runs a Getis function (Getis, Getis_parallel, Getis_integral, ...) through the cache: a stored table is
+# returned when the same image, ROI and parameters have been analyzed before, otherwise the result is computed
+# and stored. With cache=None the function is simply called.
+def cachedGetis(cache, getis, mask, maskedImage, nx, ny, **kwargs):
+    if cache is None:
+        return getis(mask, maskedImage, nx, ny, **kwargs)
+    key = getisKey(getis.__name__, mask, maskedImage, nx=nx, ny=ny, **kwargs)
+    stats = cache.get(key)
+    if stats is None:
+        stats = getis(mask, maskedImage, nx, ny, **kwargs)
+        cache.put(key, stats)
+    return stats
@@ -0,0 +1,613 @@
+# Vectorized engine functions for Getis Ord Hotspot Analysis
+# scipy is imported by the few functions that need it, as it takes longer to load than the rest of the engine
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+
+# Column layout shared by every Getis entry point
+STATS_COLUMNS = ['x', 'y', 'nx', 'ny', 'Gi', 'Mean', 'Variance', 'SD', 'Z-Score', 'p-value', 'Sign']
+FLOAT_COLUMNS = ['Gi', 'Mean', 'Variance', 'SD', 'Z-Score', 'p-value']
+# Precision modes: 'float64' accumulates in float64 (the reference); 'exact' keeps integer images in their own
+# dtype and accumulates in the smallest exact integer type; 'float32' does the same and emits float32 statistics
+PRECISIONS = ['float64', 'exact', 'float32']
+
+
+# Standard normal density, computed exactly as scipy.stats.norm.pdf
+def normPDF(z):
+    return np.exp(-z**2/2.0) / np.sqrt(2*np.pi)
+
+
+# Returns the image with masked pixels set to 0, so that plain sums only see pixels inside the ROI
+def filledImage(maskedImage):
+    return np.ma.filled(maskedImage, 0)
+
+
+
+# Global sum and sum of squares of an image, accumulated in row bands to avoid full-size float64 temporaries.
+# With exact=True integer images are accumulated in int64 and the sums returned as exact Python integers.
+def globalMoments(im, band=1024, exact=False):
+    exact = exact and np.issubdtype(im.dtype, np.integer)
+    Sxj = 0 if exact else 0.0
+    Sxj2 = 0 if exact else 0.0
+    for start in range(0, im.shape[0], band):
+        rows = np.asarray(im[start:start+band], dtype=np.int64 if exact else float)
+        Sxj += int(np.sum(rows)) if exact else np.sum(rows)
+        Sxj2 += int(np.sum(rows**2)) if exact else np.sum(rows**2)
+    return Sxj, Sxj2
+
+
+
+# Accumulator dtype of the image's integral image under a precision mode: float64 for 'float64' or non-integer
+# images, otherwise int32 when the sum of the whole image is guaranteed to fit and int64 if not
+def accumulatorDtype(im, precision='float64'):
+    if precision not in PRECISIONS:
+        raise Exception("Unknown precision " + str(precision) + ". Must be one of " + str(PRECISIONS))
+    if precision == 'float64' or not np.issubdtype(im.dtype, np.integer):
+        return float
+    if int(np.max(im, initial=0))*im.size < 2**31:
+        return np.int32
+    return np.int64
+
+
+# Accumulator dtype of the mask's integral image: int32 outside 'float64' mode when the pixel count fits
+def countDtype(mask, precision='float64'):
+    return np.int32 if precision != 'float64' and mask.size < 2**31 else np.int64
+
+
+
+# Bounding box (xmin, xmax, ymin, ymax) of the pixels inside a mask, from row and column any-reductions
+def maskBounds(mask):
+    rows = np.flatnonzero(np.any(mask, axis=1))
+    cols = np.flatnonzero(np.any(mask, axis=0))
+    if len(rows) == 0:
+        raise Exception("The ROI is empty. Make sure the ROI covers part of the image.")
+    return rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+
+
+
+# Summed-area table with a leading row and column of zeros: sat[i,j] = sum(im[:i,:j]).
+# Leading axes (e.g. a stack of images) are carried through.
+def integralImage(im, dtype=float):
+    sat = np.zeros(im.shape[:-2] + (im.shape[-2] + 1, im.shape[-1] + 1), dtype=dtype)
+    return integralInto(im, sat)
+
+
+# Fills a summed-area table allocated by integralImage (whose leading zeros are left as they are), so one buffer
+# can be reused for many images of the same shape
+def integralInto(im, sat):
+    np.cumsum(im, axis=-2, dtype=sat.dtype, out=sat[..., 1:, 1:])
+    np.cumsum(sat[..., 1:, 1:], axis=-1, out=sat[..., 1:, 1:])
+    return sat
+
+
+
+# Sums and sizes of the (2hx+1) x (2hy+1) windows centered on every (row, col) pair of the given index vectors,
+# clipped to the image like neighbours(); returns sums of shape (..., len(rows), len(cols)) and sizes
+def windowSums(sat, rows, cols, hx, hy):
+    H = sat.shape[-2] - 1
+    W = sat.shape[-1] - 1
+    r0 = np.clip(np.asarray(rows) - hx, 0, H)
+    r1 = np.clip(np.asarray(rows) + hx + 1, 0, H)
+    c0 = np.clip(np.asarray(cols) - hy, 0, W)
+    c1 = np.clip(np.asarray(cols) + hy + 1, 0, W)
+    r0, r1 = r0[:, None], r1[:, None]
+    sums = (sat[..., r1, c1] - sat[..., r0, c1]
+            - sat[..., r1, c0] + sat[..., r0, c0])
+    sizes = (r1 - r0)*(c1 - c0)
+    return sums, sizes
+
+
+
+# Neighborhood centers visited by Getis: a grid spaced by nx/ny, stopping half a neighborhood before the far edge
+def neighborhoodCenters(shape, nx, ny):
+    xs = np.arange(nx, shape[0] - (int(nx/2)), nx)
+    ys = np.arange(ny, shape[1] - (int(ny/2)), ny)
+    return xs, ys
+
+
+
+# In-ROI pixel count of every candidate window centered on xs/ys, read from the integral image of the mask,
+# and which windows to keep: those with at least min_coverage of the full (2hx+1) x (2hy+1) window inside the ROI
+def windowCoverage(maskSat, xs, ys, hx, hy, min_coverage=1.0):
+    counts = windowSums(maskSat, xs, ys, hx, hy)[0]
+    keep = (counts >= min_coverage*(2*hx + 1)*(2*hy + 1)) & (counts > 0)
+    return counts, keep
+
+
+
+# Coverage index: fraction of each neighborhood of the nx/ny grid that lies inside the ROI, for all candidate
+# centers in one vectorized step. Returns the grid's row and column centers and a len(xs) x len(ys) array.
+def coverageIndex(mask, nx, ny):
+    xs, ys = neighborhoodCenters(mask.shape, nx, ny)
+    hx, hy = int(nx/2), int(ny/2)
+    counts = windowCoverage(integralImage(mask, dtype=np.int64), xs, ys, hx, hy)[0]
+    return xs, ys, counts / ((2*hx + 1)*(2*hy + 1))
+
+
+
+# Gi*, its variance and Z-score from window sums, window sizes and the global moments of the ROI
+def getisZ(wsum, Wi, Sxj, Sxj2, n):
+    Gi = wsum / Sxj
+    Yi1 = Sxj / n
+    Yi2 = Sxj2 / n - Yi1**2
+    EGi = Wi / n
+    Var = Wi*(n - Wi)*Yi2 / ((n**2)*(n - 1)*(Yi1**2))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        Zi = (Gi - EGi) / np.sqrt(Var)
+    return Gi, Var, Zi
+
+
+
+# Builds the stats table from window sums and global moments, matching the rounding used by Getis;
+# the statistics columns are emitted as float_dtype
+def getisTable(x, y, nx, ny, wsum, Wi, Sxj, Sxj2, n, float_dtype=np.float64):
+    Gi, Var, Zi = getisZ(wsum, Wi, Sxj, Sxj2, n)
+    Yi1 = Sxj / n
+    p = normPDF(Zi)
+    stats = pd.DataFrame({'x':x, 'y':y, 'nx':nx, 'ny':ny,
+                          'Gi':np.round(Gi,10), 'Mean':np.round(np.full(len(Gi), Yi1),10),
+                          'Variance':np.round(np.broadcast_to(Var, len(Gi)),10),
+                          'SD':np.round(np.sqrt(np.broadcast_to(Var, len(Gi))),10),
+                          'Z-Score':np.round(Zi,10), 'p-value':np.round(p,20),
+                          'Sign':np.where(Zi >= 0, '+', '-')})
+    if float_dtype != np.float64:
+        stats = stats.astype({col:float_dtype for col in FLOAT_COLUMNS})
+    return stats[STATS_COLUMNS]
+
+
+
+# Float dtype of the statistics emitted under a precision mode
+def statsDtype(precision):
+    return np.float32 if precision == 'float32' else np.float64
+
+
+
+# Getis table for the nx/ny neighborhood grid from precomputed integral images of the image and of the mask
+# and the global moments (Sxj, Sxj2, n) of the ROI. Neighborhoods that are only partly inside the ROI are kept
+# when their coverage is at least min_coverage; their Gi* then uses only their in-ROI pixels.
+def gridGetis(sat, maskSat, nx, ny, moments, min_coverage=1.0, float_dtype=np.float64):
+    shape = (sat.shape[0] - 1, sat.shape[1] - 1)
+    xs, ys = neighborhoodCenters(shape, nx, ny)
+
+    counts, keep = windowCoverage(maskSat, xs, ys, int(nx/2), int(ny/2), min_coverage)
+    rows, cols = np.nonzero(keep)
+
+    wsum = windowSums(sat, xs, ys, int(nx/2), int(ny/2))[0]
+    return getisTable(xs[rows], ys[cols], nx, ny,
+                      wsum[rows, cols], counts[rows, cols].astype(float), *moments, float_dtype=float_dtype)
+
+
+
+# Getis function backed by integral images: global moments are computed once and every
+# neighborhood sum comes from four lookups into a summed-area table, in a single vectorized pass.
+# Returns the same table as Getis; with min_coverage < 1 it also keeps partially covered edge neighborhoods.
+# precision ('float64', 'exact' or 'float32', see PRECISIONS) selects integer accumulators and float32 output.
+def Getis_integral(mask, maskedImage, nx, ny, min_coverage=1.0, precision='float64'):
+    im = filledImage(maskedImage)
+    sat = integralImage(im, dtype=accumulatorDtype(im, precision))
+    moments = globalMoments(im, exact=precision != 'float64') + (np.sum(mask, dtype=float),)
+    maskSat = integralImage(mask, dtype=countDtype(mask, precision))
+    return gridGetis(sat, maskSat, nx, ny, moments, min_coverage, statsDtype(precision))
+
+
+
+# Largest absolute deviation of every statistic computed under a precision mode from the float64 reference
+# (Getis_integral with precision='float64'), plus whether both tables hold the same neighborhoods and signs
+def precisionDeviation(mask, maskedImage, nx, ny, precision='float32', min_coverage=1.0):
+    reference = Getis_integral(mask, maskedImage, nx, ny, min_coverage)
+    stats = Getis_integral(mask, maskedImage, nx, ny, min_coverage, precision)
+    deviation = {col:float(np.nanmax(np.abs(stats[col].to_numpy(dtype=float) - reference[col].to_numpy()),
+                                     initial=0)) for col in FLOAT_COLUMNS}
+    deviation['Same neighborhoods'] = bool(stats[['x', 'y']].equals(reference[['x', 'y']]))
+    deviation['Same signs'] = bool((stats['Sign'] == reference['Sign']).all())
+    return pd.Series(deviation)
+
+
+
+# Mean, SD and Skew of the Z-scores of a stats table, as summarized in the validation notebooks
+def zSummary(stats):
+    import scipy.stats as st
+    zscores = stats['Z-Score']
+    return pd.Series({'Mean':zscores.mean(), 'SD':zscores.std(), 'Skew':st.skew(zscores)})
+
+
+
+# Multi-scale Getis: computes the Getis table for every neighborhood size in `scales` (ints for square
+# neighborhoods or (nx, ny) pairs) from one shared integral image, mask integral and set of global moments.
+# Returns all tables stacked (keyed by their nx/ny columns) and a per-scale Mean/SD/Skew summary of the Z-scores.
+def Getis_multiscale(mask, maskedImage, scales, min_coverage=1.0, precision='float64'):
+    im = filledImage(maskedImage)
+    moments = globalMoments(im, exact=precision != 'float64') + (np.sum(mask, dtype=float),)
+    sat = integralImage(im, dtype=accumulatorDtype(im, precision))
+    maskSat = integralImage(mask, dtype=countDtype(mask, precision))
+
+    tables = []
+    summary = []
+    for scale in scales:
+        nx, ny = (scale, scale) if np.isscalar(scale) else scale
+        stats = gridGetis(sat, maskSat, nx, ny, moments, min_coverage, statsDtype(precision))
+        tables.append(stats)
+        summary.append(pd.concat([pd.Series({'nx':nx, 'ny':ny}), zSummary(stats)]))
+    stats = pd.concat(tables, ignore_index=True)
+    summary = pd.DataFrame(summary, columns=['nx', 'ny', 'Mean', 'SD', 'Skew']).astype({'nx':int, 'ny':int})
+    return stats, summary
+
+
+
+# Regions of an ROI set given either as a dict of full-frame boolean masks or as an integer label image
+# (0 = background, `names` optionally maps labels to region names). Returns {region: (label, bounding slices,
+# cropped mask)}, with the bounding boxes found in one pass over the label image (label is None for masks).
+def regionMasks(rois, names=None):
+    import scipy.ndimage as ndi
+    regions = {}
+    if isinstance(rois, dict):
+        for name, mask in rois.items():
+            mask = np.asarray(mask, dtype=bool)
+            found = ndi.find_objects(mask.astype(np.int8))
+            if not found:
+                raise Exception("The ROI " + str(name) + " is empty. Make sure every ROI covers part of the image.")
+            regions[name] = (None, found[0], mask[found[0]])
+    else:
+        labels = np.asarray(rois)
+        for label, box in enumerate(ndi.find_objects(labels), start=1):
+            if box is not None:
+                name = names[label] if names is not None else label
+                regions[name] = (label, box, labels[box] == label)
+    return regions
+
+
+
+# Global moments (Sxj, Sxj2, n) of every region: one weighted bincount over a label image, or a sum over each
+# mask's bounding box. With exact=True the sums of integer images are exact Python integers (as globalMoments):
+# the label image is then counted in bands short enough that every float64 partial sum is an exact integer.
+def regionMoments(im, rois, regions, exact=False):
+    exact = exact and np.issubdtype(im.dtype, np.integer)
+    if isinstance(rois, dict):
+        moments = {}
+        for name, (label, box, mask) in regions.items():
+            moments[name] = globalMoments(im[box][mask], exact=exact) + (float(np.sum(mask)),)
+        return moments
+    labels = np.asarray(rois).ravel()
+    values = np.asarray(im).ravel()
+    n = np.bincount(labels).astype(float)
+    if not exact:
+        values = values.astype(float)
+        Sxj = np.bincount(labels, weights=values)
+        Sxj2 = np.bincount(labels, weights=values**2)
+    else:
+        Sxj = [0]*len(n)
+        Sxj2 = [0]*len(n)
+        band = max(2**53 // max(int(np.max(np.abs(values), initial=0)), 1)**2, 1)
+        for start in range(0, len(values), band):
+            v = values[start:start+band].astype(float)
+            bandLabels = labels[start:start+band]
+            Sxj = [a + int(b) for a, b in zip(Sxj, np.bincount(bandLabels, weights=v, minlength=len(n)))]
+            Sxj2 = [a + int(b) for a, b in zip(Sxj2, np.bincount(bandLabels, weights=v**2, minlength=len(n)))]
+    return {name:(Sxj[label], Sxj2[label], n[label]) for name, (label, box, mask) in regions.items()}
+
+
+
+# Getis for several ROIs of one image in one pass: the image's integral image is built once and every region's
+# global moments come from one bincount over the label image (or one sum per mask). Per region, only its mask's
+# integral image over its bounding box is built, and its grid of neighborhoods is laid out from its own bounding
+# box, so each table matches Getis_integral run on the image cropped to that ROI (same local x/y coordinates).
+# With min_coverage < 1, partially covered neighborhoods need the region's own masked sums, so that region's
+# masked image is integrated over its bounding box instead.
+# precision is as in Getis_integral.
+# Returns {region: stats table} and {region: (xmin, xmax, ymin, ymax) bounding box in the image}.
+def Getis_multiROI(rois, image, nx, ny, min_coverage=1.0, names=None, precision='float64'):
+    im = np.ma.getdata(image)
+    regions = regionMasks(rois, names)
+    moments = regionMoments(im, rois, regions, exact=precision != 'float64')
+    hx, hy = int(nx/2), int(ny/2)
+    accumulator = accumulatorDtype(im, precision)
+    sat = integralImage(im, dtype=accumulator) if min_coverage >= 1 else None
+
+    results = {}
+    bounds = {}
+    for name, (label, box, mask) in regions.items():
+        xmin, ymin = box[0].start, box[1].start
+        xs, ys = neighborhoodCenters(mask.shape, nx, ny)
+        counts, keep = windowCoverage(integralImage(mask, dtype=countDtype(mask, precision)), xs, ys, hx, hy,
+                                      min_coverage)
+        rows, cols = np.nonzero(keep)
+        if sat is not None:
+            wsum = windowSums(sat, xs + xmin, ys + ymin, hx, hy)[0]
+        else:
+            wsum = windowSums(integralImage(np.where(mask, im[box], 0), dtype=accumulator), xs, ys, hx, hy)[0]
+        results[name] = getisTable(xs[rows], ys[cols], nx, ny, wsum[rows, cols], counts[rows, cols].astype(float),
+                                   *moments[name], float_dtype=statsDtype(precision))
+        bounds[name] = (xmin, box[0].stop, ymin, box[1].stop)
+    return results, bounds
+
+
+
+# Sums of all full (2hx+1) x (2hy+1) windows whose centers lie on a stride grid, using strided views into
+# the summed-area table instead of per-window indexing. Centers are rows hx, hx+sx, ... and cols hy, hy+sy, ...
+def boxSums(sat, hx, hy, sx=1, sy=1):
+    kx = 2*hx + 1
+    ky = 2*hy + 1
+    nrows = (sat.shape[0] - kx - 1) // sx + 1
+    ncols = (sat.shape[1] - ky - 1) // sy + 1
+    if nrows <= 0 or ncols <= 0:
+        return np.zeros((0, 0), dtype=sat.dtype)
+    r0 = slice(0, (nrows - 1)*sx + 1, sx)
+    r1 = slice(kx, kx + (nrows - 1)*sx + 1, sx)
+    c0 = slice(0, (ncols - 1)*sy + 1, sy)
+    c1 = slice(ky, ky + (ncols - 1)*sy + 1, sy)
+    sums = sat[r1, c1] - sat[r0, c1]
+    sums -= sat[r1, c0]
+    sums += sat[r0, c0]
+    return sums
+
+
+
+# Dense Getis map: Gi* is evaluated for neighborhoods centered every `stride` pixels (down to every pixel) by
+# box filtering the integral image. Returns a Z-score raster aligned with maskedImage, where each computed center
+# fills its stride x stride cell and pixels without an in-ROI neighborhood (at least min_coverage of it) are NaN,
+# and the same values as a Getis-style stats table.
+def Getis_dense(mask, maskedImage, nx, ny, stride=1, min_coverage=1.0):
+    sx, sy = (stride, stride) if np.isscalar(stride) else stride
+    hx, hy = int(nx/2), int(ny/2)
+    im = filledImage(maskedImage)
+    n = np.sum(mask, dtype=float)
+    Sxj, Sxj2 = globalMoments(im)
+
+    Wi = boxSums(integralImage(mask, dtype=np.int64), hx, hy, sx, sy).astype(float)
+    isValid = (Wi >= min_coverage*(2*hx + 1)*(2*hy + 1)) & (Wi > 0)
+    wsum = boxSums(integralImage(im), hx, hy, sx, sy)
+    Gi, Var, zgrid = getisZ(wsum, Wi, Sxj, Sxj2, n)
+    zgrid[~isValid] = np.nan
+
+    # Paint every center's Z-score over its stride cell so the raster lines up with the image
+    zs = np.full(im.shape, np.nan)
+    xs = hx + sx*np.arange(zgrid.shape[0])
+    ys = hy + sy*np.arange(zgrid.shape[1])
+    cells = np.repeat(np.repeat(zgrid, sx, axis=0), sy, axis=1) if (sx, sy) != (1, 1) else zgrid
+    x0, y0 = hx - sx//2, hy - sy//2
+    cells = cells[max(-x0, 0):, max(-y0, 0):]
+    x0, y0 = max(x0, 0), max(y0, 0)
+    rows = min(cells.shape[0], im.shape[0] - x0)
+    cols = min(cells.shape[1], im.shape[1] - y0)
+    zs[x0:x0+rows, y0:y0+cols] = cells[:rows, :cols]
+
+    rows, cols = np.nonzero(isValid)
+    stats = getisTable(xs[rows], ys[cols], nx, ny,
+                       wsum[rows, cols], Wi[rows, cols], Sxj, Sxj2, n)
+    return zs, stats
+
+
+
+# Window sums of the neighborhoods centered on one tile of the xs/ys grid, read from the smallest sub-image
+# (tile plus a half-neighborhood halo) that contains them. Returns centers, sums and in-ROI sizes of the kept windows.
+def tileSums(im, mask, xs, ys, hx, hy, min_coverage=1.0):
+    r0 = max(xs[0] - hx, 0)
+    r1 = min(xs[-1] + hx + 1, im.shape[0])
+    c0 = max(ys[0] - hy, 0)
+    c1 = min(ys[-1] + hy + 1, im.shape[1])
+    counts, keep = windowCoverage(integralImage(mask[r0:r1, c0:c1], dtype=np.int64),
+                                  xs - r0, ys - c0, hx, hy, min_coverage)
+    rows, cols = np.nonzero(keep)
+    wsum = windowSums(integralImage(im[r0:r1, c0:c1]), xs - r0, ys - c0, hx, hy)[0]
+    return xs[rows], ys[cols], wsum[rows, cols], counts[rows, cols]
+
+
+# Process-pool entry point for tileSums: the image and mask are opened from memmaps instead of being pickled
+def memmapTileSums(imSpec, maskSpec, *args):
+    return tileSums(openMemmap(imSpec), openMemmap(maskSpec), *args)
+
+
+# Writes an array to a memmap file in tmpdir and returns the (path, dtype, shape) spec used to reopen it
+def toMemmap(arr, tmpdir):
+    fd, path = tempfile.mkstemp(suffix='.dat', dir=tmpdir)
+    os.close(fd)
+    mm = np.memmap(path, dtype=arr.dtype, mode='w+', shape=arr.shape)
+    mm[:] = arr
+    mm.flush()
+    del mm
+    return path, arr.dtype.str, arr.shape
+
+
+# Opens a memmap written by toMemmap read-only
+def openMemmap(spec):
+    return np.memmap(spec[0], dtype=spec[1], mode='r', shape=spec[2])
+
+
+
+# Tiled parallel Getis: the neighborhood grid is split into tiles of tile=(rows, cols) neighborhoods and each
+# worker computes a whole tile vectorized. With scheduler='processes' the image and mask are written once to
+# memmaps that every worker maps read-only; scheduler='threads' shares the arrays directly.
+# Returns the same table as Getis_integral.
+def Getis_tiled(mask, maskedImage, nx, ny, workers=None, scheduler='processes', tile=(64, 64), tmpdir=None,
+                min_coverage=1.0):
+    im = filledImage(maskedImage)
+    mask = np.asarray(mask, dtype=bool)
+    n = np.sum(mask, dtype=float)
+    Sxj, Sxj2 = globalMoments(im)
+    hx, hy = int(nx/2), int(ny/2)
+    xs, ys = neighborhoodCenters(im.shape, nx, ny)
+    tiles = [(xs[i:i+tile[0]], ys[j:j+tile[1]])
+             for i in range(0, len(xs), tile[0]) for j in range(0, len(ys), tile[1])]
+    workers = workers or os.cpu_count()
+
+    if scheduler == 'threads':
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(lambda t: tileSums(im, mask, t[0], t[1], hx, hy, min_coverage), tiles))
+    elif scheduler == 'processes':
+        with tempfile.TemporaryDirectory(dir=tmpdir) as mmdir:
+            imSpec = toMemmap(np.ascontiguousarray(im), mmdir)
+            maskSpec = toMemmap(mask, mmdir)
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = [pool.submit(memmapTileSums, imSpec, maskSpec, t[0], t[1], hx, hy, min_coverage)
+                           for t in tiles]
+                results = [f.result() for f in futures]
+    else:
+        raise Exception("Invalid scheduler. Must be one of 'processes' or 'threads'.")
+
+    if len(results) == 0:
+        results = [(np.array([], dtype=int), np.array([], dtype=int), np.array([]), np.array([]))]
+    x, y, wsum, Wi = (np.concatenate(parts) for parts in zip(*results))
+    stats = getisTable(x, y, nx, ny, wsum, Wi.astype(float), Sxj, Sxj2, n)
+    # Tiles finish column-block by column-block; restore the row-major order of Getis
+    return stats.sort_values(['x', 'y'], ignore_index=True)
+
+
+
+
+# Runs one chunk of seeded permutations for Getis_permutation. Each permutation shuffles the ROI pixels in place
+# of the originals and is integrated on its own into one reused image and summed-area table, keeping only its
+# window sums. Returns, per neighborhood, how many permuted sums were >= and <= the observed ones, and the
+# Mean/SD/Skew of every permuted Z map.
+def permutationChunk(im, mask, xs, ys, rows, cols, hx, hy, observed, Wi, moments, seeds):
+    idx = np.flatnonzero(mask)
+    values = im.ravel()[idx]
+    permuted = np.zeros(im.shape, dtype=im.dtype)
+    sat = integralImage(permuted)
+    sums = np.empty((len(seeds), len(rows)))
+    for b, seed in enumerate(seeds):
+        permuted.ravel()[idx] = np.random.default_rng(seed).permutation(values)
+        sums[b] = windowSums(integralInto(permuted, sat), xs, ys, hx, hy)[0][rows, cols]
+    del permuted, sat
+    greater = np.sum(sums >= observed, axis=0)
+    less = np.sum(sums <= observed, axis=0)
+    Zi = getisZ(sums, Wi, *moments)[2]
+    import scipy.stats as st
+    summary = np.column_stack([np.mean(Zi, axis=1), np.std(Zi, axis=1, ddof=1), st.skew(Zi, axis=1)])
+    return greater, less, summary
+
+
+# Bytes one permutation worker holds for an image of `shape` and `itemsize`: the permuted image and its
+# summed-area table, the window sums of every center (x4 while they are combined), and per permutation in a batch
+# its kept window sums, Z-scores and comparisons
+def permutationBytes(shape, itemsize, centers, kept):
+    fixed = shape[0]*shape[1]*itemsize + (shape[0] + 1)*(shape[1] + 1)*8 + 4*centers*8
+    return fixed, 3*kept*8
+
+
+
+# Process-pool entry point for permutationChunk: the image and mask are opened from memmaps
+def memmapPermutationChunk(imSpec, maskSpec, *args):
+    return permutationChunk(openMemmap(imSpec), openMemmap(maskSpec), *args)
+
+
+
+# Monte Carlo null for Getis: runs `permutations` seeded shuffles of the pixels inside the ROI, in chunks of
+# `batch` permutations spread over `workers` processes or threads. Every worker integrates one permuted image at a
+# time; unless given, workers and batch are derived from memory_budget (bytes for all workers together), so the
+# defaults stay bounded on large sections. Each permutation has its own seed, so results are reproducible for a
+# given seed regardless of the worker count and batch size.
+# Returns the Getis stats table with an extra 'Pseudo p-value' column ((1 + #extreme) / (permutations + 1)) for
+# the chosen alternative ('two-sided', 'greater' for hotspots, 'less' for coldspots), and a table with the Mean, SD
+# and Skew of the Z-scores of every permutation.
+def Getis_permutation(mask, maskedImage, nx, ny, permutations=999, seed=None, batch=None,
+                      alternative='two-sided', workers=None, scheduler='processes', tmpdir=None,
+                      min_coverage=1.0, memory_budget=2**30):
+    im = np.ascontiguousarray(filledImage(maskedImage))
+    mask = np.ascontiguousarray(mask, dtype=bool)
+    n = np.sum(mask, dtype=float)
+    moments = globalMoments(im) + (n,)
+    hx, hy = int(nx/2), int(ny/2)
+
+    xs, ys = neighborhoodCenters(im.shape, nx, ny)
+    counts, keep = windowCoverage(integralImage(mask, dtype=np.int64), xs, ys, hx, hy, min_coverage)
+    rows, cols = np.nonzero(keep)
+    observed = windowSums(integralImage(im), xs, ys, hx, hy)[0][rows, cols]
+    Wi = counts[rows, cols].astype(float)
+    stats = getisTable(xs[rows], ys[cols], nx, ny, observed, Wi, *moments)
+
+    fixed, perPermutation = permutationBytes(im.shape, im.itemsize, len(xs)*len(ys), len(rows))
+    if memory_budget < fixed + perPermutation:
+        raise Exception("memory_budget is too small to hold one permuted image; increase it to at least {} bytes"
+                        .format(fixed + perPermutation))
+    if workers is None:
+        workers = max(1, min(os.cpu_count(), memory_budget // (fixed + perPermutation)))
+    if batch is None:
+        batch = max(1, min((memory_budget // workers - fixed) // perPermutation, -(-permutations // workers)))
+    seeds = np.random.SeedSequence(seed).spawn(permutations)
+    args = [(xs, ys, rows, cols, hx, hy, observed, Wi, moments, seeds[start:start + batch])
+            for start in range(0, permutations, batch)]
+    if scheduler == 'threads':
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(lambda a: permutationChunk(im, mask, *a), args))
+    elif scheduler == 'processes':
+        with tempfile.TemporaryDirectory(dir=tmpdir) as mmdir:
+            imSpec = toMemmap(im, mmdir)
+            maskSpec = toMemmap(mask, mmdir)
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = [pool.submit(memmapPermutationChunk, imSpec, maskSpec, *a) for a in args]
+                results = [f.result() for f in futures]
+    else:
+        raise Exception("Invalid scheduler. Must be one of 'processes' or 'threads'.")
+
+    greater = sum(r[0] for r in results)
+    less = sum(r[1] for r in results)
+    if alternative == 'greater':
+        extreme = greater
+    elif alternative == 'less':
+        extreme = less
+    elif alternative == 'two-sided':
+        extreme = np.minimum(2*np.minimum(greater, less), permutations)
+    else:
+        raise Exception("Invalid alternative. Must be one of 'two-sided', 'greater' or 'less'.")
+    stats['Pseudo p-value'] = (1 + extreme) / (permutations + 1)
+
+    null = pd.DataFrame(np.concatenate([r[2] for r in results]), columns=['Mean', 'SD', 'Skew'])
+    null.insert(0, 'Permutation', np.arange(permutations))
+    return stats, null
+
+
+
+# Bytes needed per image row in chunked processing: a band of the image with its ROI-zeroed copy, its mask
+# and their two integral images (plus one temporary)
+def bytesPerRow(width, itemsize):
+    return width*(2*itemsize + 1 + 8 + 8 + 8)
+
+
+# One band of rows of a chunked image with the pixels outside the ROI set to 0, and the band of the mask
+def readBand(mask, image, start, stop):
+    maskBand = np.asarray(mask[start:stop], dtype=bool)
+    return np.where(maskBand, np.asarray(image[start:stop]), 0), maskBand
+
+
+
+# Out-of-core Getis for images that do not fit in memory. `image` and `mask` can be any 2-D arrays that support
+# row slicing (np.memmap, dask or zarr arrays); they are read in bands of rows sized to memory_budget bytes, once to
+# accumulate the global moments and once more, with a half-neighborhood halo, to compute the window sums.
+# Returns the same table as Getis_integral on the in-memory image.
+def Getis_chunked(mask, image, nx, ny, memory_budget=2**30, min_coverage=1.0):
+    hx, hy = int(nx/2), int(ny/2)
+    rowBytes = bytesPerRow(image.shape[1], np.dtype(image.dtype).itemsize)
+    rowsPerBand = int(memory_budget // rowBytes)
+    if rowsPerBand < 2*hx + 1:
+        raise Exception("memory_budget is too small to hold one row of neighborhoods; increase it to at least {} bytes"
+                        .format((2*hx + 1)*rowBytes))
+
+    # First pass: global moments of the ROI
+    Sxj, Sxj2, n = 0.0, 0.0, 0.0
+    for start in range(0, image.shape[0], rowsPerBand):
+        band, maskBand = readBand(mask, image, start, start + rowsPerBand)
+        s, s2 = globalMoments(band)
+        Sxj += s
+        Sxj2 += s2
+        n += np.sum(maskBand, dtype=float)
+
+    # Second pass: neighborhood sums, a band of neighborhood rows at a time
+    xs, ys = neighborhoodCenters(image.shape, nx, ny)
+    centersPerBand = max((rowsPerBand - (2*hx + 1)) // nx + 1, 1)
+    results = []
+    for i in range(0, len(xs), centersPerBand):
+        bx = xs[i:i+centersPerBand]
+        r0, r1 = bx[0] - hx, bx[-1] + hx + 1
+        band, maskBand = readBand(mask, image, r0, r1)
+        counts, keep = windowCoverage(integralImage(maskBand, dtype=np.int64), bx - r0, ys, hx, hy, min_coverage)
+        rows, cols = np.nonzero(keep)
+        wsum = windowSums(integralImage(band), bx - r0, ys, hx, hy)[0]
+        results.append((bx[rows], ys[cols], wsum[rows, cols], counts[rows, cols]))
+        del band, maskBand
+
+    if len(results) == 0:
+        results = [(np.array([], dtype=int), np.array([], dtype=int), np.array([]), np.array([]))]
+    x, y, wsum, Wi = (np.concatenate(parts) for parts in zip(*results))
+    return getisTable(x, y, nx, ny, wsum, Wi.astype(float), Sxj, Sxj2, n)
@@ -0,0 +1,122 @@
+# Figure export stage for Getis Ord Hotspot Analysis
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+from AnalysisFunctions import processedStats
+from OutputFunctions import readStats
+from InstrumentFunctions import NULL_INSTRUMENT
+
+
+# PlottingFunctions, imported on first use so that runs without figures never load matplotlib
+def plotting():
+    import PlottingFunctions
+    return PlottingFunctions
+
+
+# Figures made for every image, by name: the file suffix and a function drawing the figure from the stats table,
+# the cropped masked image, the image name and the processedStats outputs
+FIGURES = {'Heatmap': ("_HeatmapPlot", lambda stats, img, name, p: plotting().HeatmapPlot(p['zs'])),
+           'DV_ML': ("_DV_ML_Plot",
+                     lambda stats, img, name, p: plotting().DV_ML_Plot(stats, p['zs'], p['MLaxisZs'], p['DVaxisZs'],
+                                                                       p['direction'])),
+           'Quadrant': ("_QuadrantPlot",
+                        lambda stats, img, name, p: plotting().QuadrantPlot(stats, img, p['DL'], p['VL'], p['DM'],
+                                                                            p['VM'])),
+           'Gstat': ("_GstatPlot", lambda stats, img, name, p: plotting().statsPlot(stats, img, "Gstat")),
+           'Hotspot': ("_HotspotPlot", lambda stats, img, name, p: plotting().statsPlot(stats, img, "Hotspot")),
+           'Zdistribution': ("_ZdistributionPlot",
+                             lambda stats, img, name, p: plotting().ZdistributionPlot(stats, name))}
+FIGURE_FORMATS = ['pdf', 'png', 'none']
+STATS_SUFFIX = "_GetisOrdStats"
+IMAGE_SUFFIX = "_Image.npz"
+
+
+# Saves the cropped masked image next to the stats, so figures can be redrawn later without recomputing Gi*
+def writeFigureImage(maskedImage, path):
+    np.savez_compressed(path, data=np.ma.getdata(maskedImage), mask=np.ma.getmaskarray(maskedImage))
+
+
+def readFigureImage(path):
+    with np.load(path) as f:
+        return np.ma.array(f['data'], mask=f['mask'])
+
+
+
+# Stats table and cropped masked image saved for `name` in folder `path`
+def readFigureInputs(path, name):
+    for ext in ('.npz', '.parquet', '.csv'):
+        statsPath = os.path.join(path, name + STATS_SUFFIX + ext)
+        if os.path.exists(statsPath):
+            return readStats(statsPath), readFigureImage(os.path.join(path, name + IMAGE_SUFFIX))
+    raise Exception("No stats file found for " + name + " in " + path)
+
+
+
+# Draws the selected figures (names from FIGURES, all by default) of one image and saves them in folder `path` as
+# fmt ('pdf', 'png' at dpi, or 'none' to draw nothing), each in its own instrument span.
+# Returns the paths of the files written.
+def saveFigures(stats, maskedImage, name, path, figures=None, fmt='pdf', dpi=100, instrument=None):
+    if fmt not in FIGURE_FORMATS:
+        raise Exception("Unsupported figure format. Must be one of 'pdf', 'png' or 'none'.")
+    figures = list(FIGURES) if figures is None else list(figures)
+    unknown = [f for f in figures if f not in FIGURES]
+    if unknown:
+        raise Exception("Unknown figures " + str(unknown) + ". Must be among " + str(list(FIGURES)))
+    if fmt == 'none' or not figures:
+        return []
+    import matplotlib.pyplot as plt
+    instrument = instrument or NULL_INSTRUMENT
+    with instrument.span('processedStats', neighborhoods=len(stats)):
+        direction, zs, DL, VL, DM, VM, MLaxisZs, DVaxisZs, quadrantStds = processedStats(stats, maskedImage, name)
+    processed = {'direction':direction, 'zs':zs, 'DL':DL, 'VL':VL, 'DM':DM, 'VM':VM,
+                 'MLaxisZs':MLaxisZs, 'DVaxisZs':DVaxisZs}
+    outputs = []
+    for figure in figures:
+        suffix, plot = FIGURES[figure]
+        figPath = os.path.join(path, name + suffix + "." + fmt)
+        with instrument.span('figure:' + figure, neighborhoods=len(stats)):
+            fig = plot(stats, maskedImage, name, processed)
+            fig.savefig(figPath, bbox_inches="tight", dpi=dpi)
+            plt.close(fig)
+        outputs.append(figPath)
+    return outputs
+
+
+
+# Redraws the figures of one analyzed image from its saved stats and cropped image
+def exportFigures(path, name, figures=None, fmt='pdf', dpi=100, instrument=None):
+    stats, maskedImage = readFigureInputs(path, name)
+    return saveFigures(stats, maskedImage, name, path, figures, fmt, dpi, instrument)
+
+
+
+# Names of all analyzed images in a folder that can be redrawn (their stats and cropped image are both saved)
+def figureJobs(path):
+    return sorted(f[:-len(IMAGE_SUFFIX)] for f in os.listdir(path) if f.endswith(IMAGE_SUFFIX))
+
+
+# Pool worker setup for figure export: headless plotting
+def initFigureWorker():
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+
+# Figure export stage: redraws the figures of the given (folder, name) jobs (e.g. [(path, n) for n in
+# figureJobs(path)]) in a pool of `workers` processes, independently of the Getis computation.
+# Returns a table with the status ('done' or 'failed') and files of every job.
+def exportFiguresBatch(jobs, figures=None, fmt='pdf', dpi=100, workers=None):
+    status = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=initFigureWorker) as pool:
+        futures = {pool.submit(exportFigures, path, name, figures, fmt, dpi):name for path, name in jobs}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                outputs = future.result()
+            except Exception as e:
+                print("Figure export of %s failed: %r" % (name, e))
+                status.append({'Name':name, 'Status':'failed', 'Error':repr(e), 'Outputs':[]})
+                continue
+            status.append({'Name':name, 'Status':'done', 'Error':None, 'Outputs':outputs})
+    return pd.DataFrame(status, columns=['Name', 'Status', 'Error', 'Outputs'])
@@ -0,0 +1,188 @@
+# Stage timing and memory instrumentation for Getis Ord Hotspot Analysis
+import os
+import sys
+import json
+import time
+import pandas as pd
+try:
+    import resource
+except ImportError:
+    resource = None
+
+PROFILE_SUFFIX = "_Profile.jsonl"
+
+
+# Peak resident set size of this process so far, in MB (None where the platform does not report it)
+def peakRSS():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2**20 if sys.platform == 'darwin' else rss / 2**10
+
+
+
+# Record of one finished stage, with the context of the instrument it is handed to
+def spanRecord(instrument, name, start, wall_s, cpu_s, counts, exc=None):
+    record = dict(instrument.context)
+    record.update({'stage':name, 'start':start, 'wall_s':wall_s, 'cpu_s':cpu_s, 'peak_rss_mb':peakRSS(),
+                   'counts':{k:int(v) for k, v in counts.items()}, 'error':None if exc is None else repr(exc)})
+    return record
+
+
+
+# One named stage of a run: records wall time, CPU time of the thread running it (so stages on other threads are
+# not counted), peak RSS and any item counts (pixels, neighborhoods, ...) given up front or added with count() while
+# the stage runs, and hands the record to its instrument on exit
+class Span:
+
+    def __init__(self, instrument, name, counts):
+        self.instrument = instrument
+        self.name = name
+        self.counts = dict(counts)
+
+    def count(self, **counts):
+        self.counts.update(counts)
+
+    def __enter__(self):
+        self.start = time.time()
+        self.wall = time.perf_counter()
+        self.cpu = time.thread_time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.instrument.emit(spanRecord(self.instrument, self.name, self.start, time.perf_counter() - self.wall,
+                                        time.thread_time() - self.cpu, self.counts, exc))
+        return False
+
+
+
+# Total of the stage spans of one item whose stages run on different threads (as an image in
+# BatchHotspot_pipeline): bound as a sink, it adds up their wall and CPU times, and emit() hands the total to
+# `instrument` as one span, without the time the item spent waiting between stages
+class StageTotals:
+
+    def __init__(self, instrument):
+        self.instrument = instrument
+        self.start = None
+        self.wall_s = 0.0
+        self.cpu_s = 0.0
+        self.counts = {}
+
+    def __call__(self, record):
+        self.start = record['start'] if self.start is None else min(self.start, record['start'])
+        self.wall_s += record['wall_s']
+        self.cpu_s += record['cpu_s']
+
+    def count(self, **counts):
+        self.counts.update(counts)
+
+    def emit(self, name, exc=None):
+        self.instrument.emit(spanRecord(self.instrument, name, self.start, self.wall_s, self.cpu_s, self.counts, exc))
+
+
+
+# Records named spans around pipeline stages and passes every finished span to each sink (any callable taking the
+# span record, e.g. JSONLinesSink or ProgressReporter). Keyword arguments are added to every record as context.
+class Instrument:
+
+    def __init__(self, *sinks, **context):
+        self.sinks = list(sinks)
+        self.context = context
+        self.records = []
+
+    def span(self, name, **counts):
+        return Span(self, name, counts)
+
+    # Instrument with the same sinks plus `sinks`, extra context (e.g. the image name) for its records, and the
+    # same record list, so table() of the parent instrument also shows the spans of bound ones
+    def bind(self, *sinks, **context):
+        bound = Instrument(*(self.sinks + list(sinks)), **dict(self.context, **context))
+        bound.records = self.records
+        return bound
+
+    def emit(self, record):
+        self.records.append(record)
+        for sink in self.sinks:
+            sink(record)
+
+    def table(self):
+        return pd.json_normalize(self.records)
+
+
+
+# Default instrument: spans cost nothing and record nothing
+class NullSpan:
+
+    def count(self, **counts):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+class NullInstrument(Instrument):
+
+    def span(self, name, **counts):
+        return NULL_SPAN
+
+    def emit(self, record):
+        pass
+
+    # Stays free until a sink is bound, but keeps the context so the records of that sink carry it
+    def bind(self, *sinks, **context):
+        context = dict(self.context, **context)
+        return Instrument(*sinks, **context) if sinks else NullInstrument(**context)
+
+
+NULL_SPAN = NullSpan()
+NULL_INSTRUMENT = NullInstrument()
+
+
+
+# Sink appending every span record as one JSON line to a file (the file is started afresh with truncate=True)
+class JSONLinesSink:
+
+    def __init__(self, path, truncate=False):
+        self.path = path
+        if truncate:
+            open(path, 'w').close()
+
+    def __call__(self, record):
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(record, default=str) + "\n")
+
+
+def readSpans(path):
+    with open(path) as f:
+        return pd.json_normalize([json.loads(line) for line in f if line.strip()])
+
+
+# Span records of every image profiled in an output folder (and its subfolders), one row per span
+def readProfiles(path):
+    paths = sorted(os.path.join(root, f) for root, dirs, files in os.walk(path)
+                   for f in files if f.endswith(PROFILE_SUFFIX))
+    if not paths:
+        raise Exception("No profiles found in " + path)
+    return pd.concat([readSpans(p) for p in paths], ignore_index=True)
+
+
+
+# Sink showing progress with tqdm.auto (a widget in notebooks, a text bar elsewhere): the bar advances when a
+# span named `unit` finishes and shows the last finished stage and its wall time
+class ProgressReporter:
+
+    def __init__(self, total=None, unit='image', desc='Hotspot analysis'):
+        from tqdm.auto import tqdm
+        self.unit = unit
+        self.bar = tqdm(total=total, desc=desc, unit=unit)
+
+    def __call__(self, record):
+        self.bar.set_postfix_str("%s %.2f s" % (record['stage'], record['wall_s']))
+        if record['stage'] == self.unit:
+            self.bar.update(1)
+
+    def close(self):
+        self.bar.close()
@@ -0,0 +1,110 @@
+# Typed columnar output of Getis stats tables for Getis Ord Hotspot Analysis
+import os
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+from CacheFunctions import hashArray
+
+# Columns stored as integers; 'Sign' is stored as int8 (+1/-1) and restored to '+'/'-' on read
+INT_COLUMNS = ['x', 'y', 'nx', 'ny']
+METADATA_KEY = '__metadata__'
+
+
+# Short hash identifying an ROI mask, stored with the stats so results can be traced back to their ROI
+def roiHash(mask):
+    h = hashlib.blake2b(digest_size=12)
+    hashArray(h, np.asarray(mask, dtype=bool))
+    return h.hexdigest()
+
+
+
+# Mouse, section and hemisphere encoded in an image name such as 'Mouse1_sectionB4R_20x20'
+def nameMetadata(name):
+    if 'section' not in name:
+        return {}
+    section = name.split("section")[1]
+    return {'Mouse':name.split('_section')[0], 'Section':section[:2], 'Hemisphere':section[2:3]}
+
+
+
+# Converts a stats table to typed column arrays: coordinates as int32, statistics as float_dtype and Sign as int8
+def packStats(stats, float_dtype=np.float64):
+    columns = {}
+    for col in stats.columns:
+        if col in INT_COLUMNS:
+            columns[col] = stats[col].to_numpy(dtype=np.int32)
+        elif col == 'Sign':
+            columns[col] = np.where(stats[col] == '+', 1, -1).astype(np.int8)
+        elif pd.api.types.is_numeric_dtype(stats[col]):
+            columns[col] = stats[col].to_numpy(dtype=float_dtype)
+        else:
+            columns[col] = stats[col].to_numpy(dtype=str)
+    return columns
+
+
+def unpackColumn(col, values):
+    if col == 'Sign':
+        return np.where(values > 0, '+', '-')
+    return values
+
+
+
+# Writes a stats table as .npz (numpy only) or .parquet (needs pyarrow), chosen by the file extension, with the
+# run parameters in `metadata` (e.g. threshold, downsample, nx, ny, direction, source file, ROI hash) embedded in
+# the file. .csv is also accepted and written as before, without metadata.
+def writeStats(stats, path, metadata=None, float_dtype=np.float64, compress=False):
+    metadata = dict(metadata or {})
+    metadata['columns'] = list(stats.columns)
+    ext = os.path.splitext(path)[1]
+    if ext == '.npz':
+        columns = packStats(stats, float_dtype)
+        columns[METADATA_KEY] = np.array(json.dumps(metadata, default=str))
+        if compress:
+            np.savez_compressed(path, **columns)
+        else:
+            np.savez(path, **columns)
+    elif ext == '.parquet':
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        table = pa.table(packStats(stats, float_dtype))
+        table = table.replace_schema_metadata({METADATA_KEY:json.dumps(metadata, default=str)})
+        pq.write_table(table, path)
+    elif ext == '.csv':
+        stats.to_csv(path)
+    else:
+        raise Exception("Unsupported stats file format. Must be one of '.npz', '.parquet' or '.csv'.")
+
+
+
+# Reads a stats table written by writeStats; `columns` restricts the read to the given columns (e.g. ['Z-Score'])
+def readStats(path, columns=None):
+    ext = os.path.splitext(path)[1]
+    if ext == '.npz':
+        with np.load(path) as data:
+            if columns is None:
+                columns = json.loads(str(data[METADATA_KEY]))['columns']
+            return pd.DataFrame({col:unpackColumn(col, data[col]) for col in columns})
+    elif ext == '.parquet':
+        import pyarrow.parquet as pq
+        table = pq.read_table(path, columns=columns)
+        return pd.DataFrame({col:unpackColumn(col, table.column(col).to_numpy()) for col in table.column_names})
+    elif ext == '.csv':
+        stats = pd.read_csv(path, index_col=0)
+        return stats if columns is None else stats[columns]
+    else:
+        raise Exception("Unsupported stats file format. Must be one of '.npz', '.parquet' or '.csv'.")
+
+
+
+# Reads only the embedded run parameters of a stats file written by writeStats
+def readStatsMetadata(path):
+    ext = os.path.splitext(path)[1]
+    if ext == '.npz':
+        with np.load(path) as data:
+            return json.loads(str(data[METADATA_KEY]))
+    elif ext == '.parquet':
+        import pyarrow.parquet as pq
+        return json.loads(pq.read_schema(path).metadata[METADATA_KEY.encode()])
+    else:
+        raise Exception("Only '.npz' and '.parquet' stats files carry metadata.")
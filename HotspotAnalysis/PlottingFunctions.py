@@ -8,8 +8,12 @@ Created on Sat Jul 20 19:30:16 2019
 
 # Plotting Functions for Getis Ord Hotspot Analysis
 import numpy as np
+import pandas as pd
 import matplotlib.pyplot as plt
-import seaborn as sns
+from matplotlib.collections import PathCollection
+from matplotlib.font_manager import FontProperties
+from matplotlib.textpath import TextPath
+from matplotlib.transforms import Affine2D, IdentityTransform
 
 
 # Plots a given image with the ROI and Z-score labeled
@@ -25,58 +29,82 @@ def PlotGetis (img,x,y,nx,ny,Zi):
 
 
 
-# Plots the stats associated with a Getis analysis of an image as either "Gstat" or "Hotspot"
-def statsPlot(stats, img, plotType, withImage=True):
+# Marker colors and sizes (in points) of every neighborhood in a "Gstat" or "Hotspot" plot. Gstat markers are
+# salmon/lightblue by sign and scale with |Z|; Hotspot markers are binned by Z against the mean +/- SD and SD/2 of
+# all Z-scores and scale with the neighborhood size.
+def statsPlotStyle(stats, plotType):
+    Zi = stats['Z-Score'].to_numpy(dtype=float)
+    if plotType == "Gstat":
+        sizes = np.abs(Zi)/np.log2(stats.shape[0])*2
+        sign = stats['Sign'].to_numpy()
+        colors = np.select([sign == "+", sign == "-"], ['salmon', 'lightblue'], 'none')
+    elif plotType == "Hotspot":
+        sizes = np.sqrt(stats['nx'].to_numpy(dtype=float)*stats['ny'].to_numpy(dtype=float))/2
+        mean = np.mean(Zi)
+        std = np.std(Zi)
+        colors = np.select([Zi > mean + std, Zi > mean + std/2, Zi < mean - std, Zi < mean - std/2],
+                           ['firebrick', 'coral', 'dodgerblue', 'lightskyblue'], 'antiquewhite')
+    else:
+        raise Exception("No proper plotType specified. Proper plot types include 'Gstat' or 'Hotspot'")
+    return colors, sizes
+
+
+
+# Text layer drawing every label as a bold outline centered on its point, with the font size given per label in
+# points. Labels sharing text and font size go into one collection holding a single outline (built once per text,
+# at unit size), which vector backends write once and stamp at every position.
+def textCollections(ax, labels, xs, ys, fontsizes, color='black', rasterized=False):
+    prop = FontProperties(weight='bold')
+    offsets = np.column_stack([xs, ys])
+    outlines = {}
+    texts = []
+    groups = pd.DataFrame({'label':labels, 'size':fontsizes}).groupby(['label', 'size']).indices
+    for (label, size), where in groups.items():
+        if label not in outlines:
+            path = TextPath((0, 0), label, size=1, prop=prop)
+            (x0, y0), (x1, y1) = path.get_extents().get_points()
+            outlines[label] = path.transformed(Affine2D().translate(-(x0 + x1)/2, -(y0 + y1)/2))
+        text = PathCollection([outlines[label]], sizes=[size**2], offsets=offsets[where],
+                              offset_transform=ax.transData, transform=IdentityTransform(), facecolors=color,
+                              edgecolors='none', rasterized=rasterized)
+        ax.add_collection(text, autolim=False)
+        texts.append(text)
+    return texts
+
+
+
+# Plots the stats associated with a Getis analysis of an image as either "Gstat" or "Hotspot".
+# Markers are drawn as one collection per color and size, and Z-score labels as one collection per text and size,
+# with sizes rounded to size_step points, so a section takes a few hundred artists instead of two per neighborhood.
+# rasterized=True embeds the marker and label layers as a bitmap (smaller, faster PDFs for large sections) and
+# labels=False leaves the labels out.
+def statsPlot(stats, img, plotType, withImage=True, labels=True, rasterized=False, size_step=0.1):
     fig = plt.figure(figsize=(25,15), dpi=100)
     ax = plt.axes([0,0,1,1], frameon=False)
     ax.get_xaxis().set_visible(False)
     ax.get_yaxis().set_visible(False)
     if withImage:
-        plt.imshow(img, cmap='gist_gray')
+        ax.imshow(img, cmap='gist_gray')
     else:
-        plt.axes().set_aspect('equal')
-        plt.ylim(img.shape[0],0)
+        ax.set_aspect('equal')
     # Drawing paramters
     mrk = 'o'
-    #cl = 'darkred'
-    #style = ':'
-    #width = 1.5
     alpha = 0.5
     mew = 0
-    for g in range(stats.shape[0]):
-        x = stats['x'][g]
-        y = stats['y'][g]
-        nx = stats['nx'][g]
-        ny = stats['ny'][g]
-        Zi = stats['Z-Score'][g]
-        if plotType == "Gstat":
-            mrksz = np.abs(Zi)/np.log2(stats.shape[0])*2
-            if stats['Sign'][g] == "+":
-                plt.plot(y,x,marker='o',color='salmon', markersize=mrksz, alpha=0.5, markeredgewidth=mew)
-            elif stats['Sign'][g] == "-":
-                plt.plot(y,x,marker='o',color='lightblue', markersize=mrksz, alpha=0.5, markeredgewidth=mew)
-            plt.text(y,x,
-                     s=int(Zi), color='black', fontsize=mrksz/2,
-                     horizontalalignment='center', verticalalignment='center', fontweight='bold')
-        elif plotType == "Hotspot":
-            mrksz = np.sqrt(nx*ny)/2
-            if Zi > (np.mean(stats['Z-Score']) + np.std(stats['Z-Score'])):
-                plt.plot(y,x,marker=mrk,color='firebrick', markersize=mrksz, alpha=alpha, markeredgewidth=mew)
-            elif Zi > (np.mean(stats['Z-Score']) + np.std(stats['Z-Score'])/2):
-                plt.plot(y,x,marker=mrk,color='coral', markersize=mrksz, alpha=alpha, markeredgewidth=mew)
-            elif Zi < (np.mean(stats['Z-Score']) - np.std(stats['Z-Score'])):
-                plt.plot(y,x,marker=mrk,color='dodgerblue', markersize=mrksz, alpha=alpha, markeredgewidth=mew)
-            elif Zi < (np.mean(stats['Z-Score']) - np.std(stats['Z-Score'])/2):
-                plt.plot(y,x,marker=mrk,color='lightskyblue', markersize=mrksz, alpha=alpha, markeredgewidth=mew)
-            else:
-                plt.plot(y,x,marker=mrk,color='antiquewhite', markersize=mrksz, alpha=alpha, markeredgewidth=mew)
-            plt.text(y,x,
-                     s=int(Zi), color='black', fontsize=mrksz/2,
-                     horizontalalignment='center', verticalalignment='center', fontweight='bold')
-        #plt.hlines(y=x+nx, xmin=y - ny, xmax=y + ny, color=cl, linestyle=style, linewidth=width, alpha=alpha)
-        #plt.hlines(y=x-nx, xmin=y - ny, xmax=y + ny, color=cl, linestyle=style, linewidth=width, alpha=alpha)
-        #plt.vlines(x=y+ny, ymin=x - nx, ymax=x + nx, color=cl, linestyle=style, linewidth=width, alpha=alpha)
-        #plt.vlines(x=y-ny, ymin=x - nx, ymax=x + nx, color=cl, linestyle=style, linewidth=width, alpha=alpha)
+    colors, mrksz = statsPlotStyle(stats, plotType)
+    mrksz = np.round(mrksz/size_step)*size_step
+    x = stats['x'].to_numpy()
+    y = stats['y'].to_numpy()
+    groups = pd.DataFrame({'color':colors, 'size':mrksz}).groupby(['color', 'size']).indices
+    for (color, size), where in groups.items():
+        if color != 'none':
+            ax.scatter(y[where], x[where], s=size**2, color=color, marker=mrk, alpha=alpha, linewidths=mew,
+                       rasterized=rasterized)
+    if labels:
+        Zi = stats['Z-Score'].to_numpy(dtype=float).astype(int)
+        textCollections(ax, Zi.astype(str), y, x, mrksz/2, rasterized=rasterized)
+    if not withImage:
+        ax.set_ylim(img.shape[0],0)
     return fig
 
 
@@ -163,6 +191,7 @@ def QuadrantPlot(stats, img, DL, VL, DM, VM):
 
 # Plot histogram and density of z-scores from Getis analysis
 def ZdistributionPlot(stats, name):
+    import seaborn as sns
     ZdistributionPlot = plt.figure(figsize=(20,10))
     sns.distplot(stats['Z-Score'], hist=True, 
                  bins=int(len(stats['Z-Score'])/10), color = 'slategrey',
@@ -7,42 +7,158 @@ Created on Sat Jul 20 18:30:36 2019
 """
 
 # ROI Functions for Getis Ord Hotspot Analysis
+# matplotlib and holoviews are imported by the interactive functions that use them, so batch workers loading ROI
+# masks do not pay for them
+import json
 import numpy as np
-import matplotlib.pyplot as plt
 import cv2
-import holoviews as hv
-from holoviews import streams
+from EngineFunctions import maskBounds
 
 
-def make_ROI(img, DAPI, region, vertices):
+# Crops an image to the bounding box of a mask that was cropped to `bounds` (or is full frame when bounds is None)
+# and masks it. Returns the cropped mask, the cropped image and the cropped masked image, without copying the image.
+def cropToMask(img, mask, bounds=None):
+    if bounds is None:
+        bounds = maskBounds(mask)
+        mask = mask[bounds[0]:bounds[1], bounds[2]:bounds[3]]
+    xmin, xmax, ymin, ymax = bounds
+    croppedImg = img[xmin:xmax,ymin:ymax]
+    return mask, croppedImg, np.ma.array(croppedImg, mask=~mask, copy=False)
+
+
+# Expands a cropped mask back to a full-frame mask of the given shape
+def fullMask(mask, bounds, shape):
+    full = np.zeros(shape, dtype=bool)
+    full[bounds[0]:bounds[1], bounds[2]:bounds[3]] = mask
+    return full
+
+
+
+# Rasterizes a polygon (vertex x and y coordinates in image pixels) directly into a boolean mask cropped to the
+# polygon's extent within an image of the given shape. Returns the cropped mask and its bounds.
+def rasterizePolygon(xs, ys, shape):
+    xy = np.column_stack((xs, ys)).astype(np.int64)
+    ymin = max(int(xy[:,0].min()), 0)
+    ymax = min(int(xy[:,0].max()) + 1, shape[1])
+    xmin = max(int(xy[:,1].min()), 0)
+    xmax = min(int(xy[:,1].max()) + 1, shape[0])
+    if xmin >= xmax or ymin >= ymax:
+        raise Exception("The ROI is empty. Make sure the ROI covers part of the image.")
+    mask = np.zeros((xmax - xmin, ymax - ymin), dtype=np.uint8)
+    cv2.fillPoly(mask, pts=[(xy - [ymin, xmin]).astype(np.int32)], color=1)
+    bounds = maskBounds(mask)
+    mask = mask[bounds[0]:bounds[1], bounds[2]:bounds[3]].astype(bool)
+    return mask, (xmin + bounds[0], xmin + bounds[1], ymin + bounds[2], ymin + bounds[3])
+
+
+
+# Run-length encoding of a mask in row-major order: lengths of alternating runs, starting with a run of False
+def encodeRLE(mask):
+    flat = np.asarray(mask, dtype=bool).ravel()
+    changes = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    runs = np.diff(np.concatenate(([0], changes, [flat.size])))
+    if flat.size and flat[0]:
+        runs = np.concatenate(([0], runs))
+    return runs.tolist()
+
+
+def decodeRLE(runs, shape):
+    values = np.arange(len(runs)) % 2 == 1
+    return np.repeat(values, runs).reshape(shape)
+
+
+
+# The ROIs of one image, stored compactly as polygon vertices or run-length encoded cropped masks. Masks are
+# rasterized (or decoded) on first use and kept cropped to their bounds, so several ROIs on a large section cost
+# about as much memory as the ROIs themselves.
+class ROISet:
+
+    def __init__(self, shape, rois=None):
+        self.shape = tuple(int(s) for s in shape)
+        self.rois = dict(rois or {})
+        self.masks = {}
+
+    @property
+    def names(self):
+        return list(self.rois)
+
+    def addPolygon(self, name, xs, ys):
+        self.rois[name] = {'polygon':[[float(x), float(y)] for x, y in zip(xs, ys)]}
+        self.masks.pop(name, None)
+
+    # Stores a mask (full frame, or cropped to bounds) run-length encoded
+    def addMask(self, name, mask, bounds=None):
+        if bounds is None:
+            bounds = maskBounds(mask)
+            mask = mask[bounds[0]:bounds[1], bounds[2]:bounds[3]]
+        bounds = [int(b) for b in bounds]
+        self.rois[name] = {'bounds':bounds, 'rle':encodeRLE(mask)}
+        self.masks[name] = (np.asarray(mask, dtype=bool), tuple(bounds))
+
+    # Cropped boolean mask of an ROI and its bounds (xmin, xmax, ymin, ymax) in the image
+    def mask(self, name='ROI'):
+        if name not in self.masks:
+            roi = self.rois[name]
+            if 'polygon' in roi:
+                xy = np.array(roi['polygon'])
+                self.masks[name] = rasterizePolygon(xy[:,0], xy[:,1], self.shape)
+            else:
+                xmin, xmax, ymin, ymax = roi['bounds']
+                self.masks[name] = (decodeRLE(roi['rle'], (xmax - xmin, ymax - ymin)), tuple(roi['bounds']))
+        return self.masks[name]
+
+    def fullMask(self, name='ROI'):
+        return fullMask(*self.mask(name), self.shape)
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            json.dump({'shape':self.shape, 'rois':self.rois}, f)
+
+
+
+def readROISet(path):
+    with open(path) as f:
+        data = json.load(f)
+    return ROISet(data['shape'], data['rois'])
+
+
+
+# Cropped mask and bounds of an ROI file: a ROISet .json file (ROI `name`) or a full-frame mask image (e.g. TIFF)
+def loadROIMask(roiPath, name='ROI'):
+    if roiPath.endswith('.json'):
+        return readROISet(roiPath).mask(name)
+    mask = cv2.imread(roiPath)[:,:,0].astype(bool)
+    bounds = maskBounds(mask)
+    return np.ascontiguousarray(mask[bounds[0]:bounds[1], bounds[2]:bounds[3]]), bounds
+
+
+
+# ROIs drawn with ROI_plot, as a ROISet of polygons named after `region`
+def verticesROISet(vertices, region, shape):
+    rois = ROISet(shape)
+    for vertex in range(len(vertices.data['xs'])):
+        rois.addPolygon(region[vertex], vertices.data['xs'][vertex], vertices.data['ys'][vertex])
+    return rois
+
+
+
+# Rasterizes the drawn ROIs and crops the image to the 'ROI' region. Passing roiPath also saves the drawn ROIs
+# there as a ROISet .json file, which load_ROI and BatchHotspot accept in place of a mask image.
+def make_ROI(img, DAPI, region, vertices, roiPath=None):
     
     # Create ROI masks to overlay over image
-    ROI_masks = {}
-    for vertex in range(len(vertices.data['xs'])):
-        x = np.array(vertices.data['xs'][vertex]) #x coordinates
-        y = np.array(vertices.data['ys'][vertex]) #y coordinates
-        xy = np.column_stack((x,y)).astype('uint64') #xy coordinate pairs
-        mask = np.zeros(DAPI.shape) # create empty mask
-        cv2.fillPoly(mask, pts =[xy], color=255) #fill polygon
-        ROI_masks[region[vertex]] = mask==255 #save to ROI masks as boolean
+    rois = verticesROISet(vertices, region, DAPI.shape)
+    if roiPath is not None:
+        rois.write(roiPath)
     xs = vertices.data['xs'][0]
     ys = vertices.data['ys'][0]
 
-    mask = ROI_masks['ROI']
-    maskedImage = np.ma.array(img, mask = ~ROI_masks['ROI'])
-    xrange = np.nanargmin(maskedImage, axis=1)
-    yrange = np.nanargmin(maskedImage, axis=0)
-    xmin = next((i for i, x in enumerate(xrange) if x), None)
-    xmax = len(xrange) - next((i for i, x in enumerate(np.flip(xrange, axis=0)) if x), None)
-    ymin = next((i for i, x in enumerate(yrange) if x), None)
-    ymax = len(yrange) - next((i for i, x in enumerate(np.flip(yrange, axis=0)) if x), None)
-    croppedImg = img[xmin:xmax,ymin:ymax]
-    mask = mask[xmin:xmax,ymin:ymax]
-    maskedImage = maskedImage[xmin:xmax,ymin:ymax]
-    
+    mask, bounds = rois.mask('ROI')
+    mask, croppedImg, maskedImage = cropToMask(img, mask, bounds)
     
+    import matplotlib.pyplot as plt
     fig1 = plt.figure(figsize=(25,15))
-    plt.imshow(img*ROI_masks['ROI'], cmap='pink')
+    plt.imshow(img*rois.fullMask('ROI'), cmap='pink')
     plt.imshow(img, cmap='gist_gray', alpha=0.6)
     plt.plot([xs[-1],xs[0]],[ys[-1],ys[0]], 'ro-', alpha=0.2)
     for i in range(0, len(xs)):
@@ -60,23 +176,15 @@ def make_ROI(img, DAPI, region, vertices):
 
 def load_ROI(img, DAPI, roiPath):
     
-    # load mask using the roiPath
-    mask = cv2.imread(roiPath)[:,:,0].astype(bool)
+    # load mask using the roiPath (a mask image or a ROISet .json file), cropped to the ROI
+    new_mask, bounds = loadROIMask(roiPath)
     
     # create mask as in make_ROI function
-    maskedImage = np.ma.array(img, mask = ~mask)
-    xrange = np.nanargmin(maskedImage, axis=1)
-    yrange = np.nanargmin(maskedImage, axis=0)
-    xmin = next((i for i, x in enumerate(xrange) if x), None)
-    xmax = len(xrange) - next((i for i, x in enumerate(np.flip(xrange, axis=0)) if x), None)
-    ymin = next((i for i, x in enumerate(yrange) if x), None)
-    ymax = len(yrange) - next((i for i, x in enumerate(np.flip(yrange, axis=0)) if x), None)
-    croppedImg = img[xmin:xmax,ymin:ymax]
-    new_mask = mask[xmin:xmax,ymin:ymax]
-    maskedImage = maskedImage[xmin:xmax,ymin:ymax]
+    new_mask, croppedImg, maskedImage = cropToMask(img, new_mask, bounds)
     
+    import matplotlib.pyplot as plt
     fig1 = plt.figure(figsize=(25,15))
-    plt.imshow(img*mask, cmap='pink')
+    plt.imshow(img*fullMask(new_mask, bounds, img.shape), cmap='pink')
     plt.imshow(img, cmap='gist_gray', alpha=0.6)
 #     plt.plot([xs[-1],xs[0]],[ys[-1],ys[0]], 'ro-', alpha=0.2)
 #     for i in range(0, len(xs)):
@@ -94,6 +202,8 @@ def load_ROI(img, DAPI, roiPath):
 
 # Define function that allows you to draw your ROI
 def ROI_plot(reference,region_names):
+    import holoviews as hv
+    from holoviews import streams
 
     #Define parameters for plot presentation
     nobjects = len(region_names) #get number of objects to be drawn
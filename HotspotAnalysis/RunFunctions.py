@@ -0,0 +1,115 @@
+# Declarative run configs for headless Getis Ord Hotspot Analysis batch jobs
+import os
+import json
+import time
+import socket
+import pandas as pd
+from UtilFunctions import gitCommit, writeJSON
+
+RUN_RECORD = "hotspot_run.json"
+
+# Settings of a run config and their defaults. Every entry of `params` is one parameter set and may override any
+# of the analysis settings (threshold through native_depth) for that set.
+RUN_DEFAULTS = {'filesDir':None, 'saveDir':None, 'workers':None, 'max_memory':None, 'cache':None,
+                'cache_bytes':2**30, 'figure_workers':None, 'params':None,
+                'threshold':None, 'downsample':False, 'nx':None, 'ny':None, 'output_format':'csv',
+                'figures':None, 'figure_format':'pdf', 'profile':True, 'native_depth':False}
+PARAM_KEYS = ['saveDir', 'threshold', 'downsample', 'nx', 'ny', 'output_format', 'figures', 'figure_format',
+              'profile', 'native_depth']
+
+
+# Reads a YAML (or JSON) run config, e.g.
+#   filesDir: /data/cohort1/
+#   saveDir: /data/cohort1/hotspots/
+#   threshold: 200
+#   workers: 8
+#   figures: [Hotspot, Heatmap]
+#   params:
+#     - {nx: 20, ny: 20}
+#     - {nx: 40, ny: 40, figure_format: none}
+def readRunConfig(path):
+    with open(path) as f:
+        if path.endswith('.json'):
+            config = json.load(f)
+        else:
+            import yaml
+            config = yaml.safe_load(f)
+    if not isinstance(config, dict):
+        raise Exception("The run config " + path + " must be a mapping of settings.")
+    return config
+
+
+# Validated config with defaults filled in and one fully specified dict of processing arguments per parameter set.
+# A config without `params` is a single parameter set taken from its top-level settings.
+def resolveRunConfig(config):
+    unknown = [k for k in config if k not in RUN_DEFAULTS]
+    if unknown:
+        raise Exception("Unknown run config settings " + str(unknown) + ". Must be among " + str(list(RUN_DEFAULTS)))
+    config = dict(RUN_DEFAULTS, **config)
+    if config['filesDir'] is None:
+        raise Exception("The run config must give filesDir, the folder holding Images/ and ROIs/.")
+    config['filesDir'] = os.path.join(os.path.expanduser(config['filesDir']), '')
+
+    paramSets = []
+    outputs = set()
+    for overrides in (config['params'] or [{}]):
+        unknown = [k for k in overrides if k not in PARAM_KEYS]
+        if unknown:
+            raise Exception("Unknown parameter set settings " + str(unknown) + ". Must be among " + str(PARAM_KEYS))
+        params = {k:overrides.get(k, config[k]) for k in PARAM_KEYS}
+        missing = [k for k in ['threshold', 'nx', 'ny'] if params[k] is None]
+        if missing:
+            raise Exception("Parameter set " + str(overrides) + " is missing " + str(missing) + ".")
+        if params['figures'] == 'all':
+            params['figures'] = None
+        # Outputs are named by neighborhood size, so two sets of the same size must be saved to different folders
+        key = (params['saveDir'], params['nx'], params['ny'])
+        if key in outputs:
+            raise Exception("Two parameter sets write %dx%d outputs to the same folder; give them different saveDirs."
+                            % (params['nx'], params['ny']))
+        outputs.add(key)
+        paramSets.append(params)
+    config['params'] = paramSets
+    return config
+
+
+
+# Runs every parameter set of a run config (a dict or the path of a YAML/JSON file) over all image/ROI pairs of
+# filesDir with BatchHotspot_pool. The resolved config, its source file, code version, host, timings and
+# per-image status of each set are recorded in hotspot_run.json in each output folder (saveDir, or filesDir).
+# Returns the status table of all sets, with the neighborhood size of each row.
+def runConfig(config, source=None):
+    from BatchFunctions import loadImagesROIs, BatchHotspot_pool
+    from CacheFunctions import GetisCache
+    if isinstance(config, str):
+        config, source = readRunConfig(config), config
+    config = resolveRunConfig(config)
+    filesDir = config['filesDir']
+    images, ROIs = loadImagesROIs(filesDir)
+    cache = GetisCache(config['cache'], config['cache_bytes']) if config['cache'] is not None else None
+
+    tables = []
+    for params in config['params']:
+        outDir = params['saveDir'] if params['saveDir'] is not None else filesDir
+        os.makedirs(outDir, exist_ok=True)
+        record = {'config':source, 'filesDir':filesDir, 'params':params, 'workers':config['workers'],
+                  'figure_workers':config['figure_workers'], 'max_memory':config['max_memory'],
+                  'cache':config['cache'], 'commit':gitCommit(), 'host':socket.gethostname(),
+                  'images':len(images), 'started':time.strftime("%Y-%m-%dT%H:%M:%S")}
+        print("Running %dx%d neighborhoods on %d images" % (params['nx'], params['ny'], len(images)))
+        status = BatchHotspot_pool(filesDir, images, ROIs, params['threshold'], params['downsample'],
+                                   params['nx'], params['ny'], params['saveDir'], config['workers'],
+                                   config['max_memory'], cache=cache, output_format=params['output_format'],
+                                   figures=params['figures'], figure_format=params['figure_format'],
+                                   figure_workers=config['figure_workers'], profile=params['profile'],
+                                   native_depth=params['native_depth'])
+        record['finished'] = time.strftime("%Y-%m-%dT%H:%M:%S")
+        record['status'] = status.to_dict('records')
+        runs = []
+        recordPath = os.path.join(outDir, RUN_RECORD)
+        if os.path.exists(recordPath):
+            with open(recordPath) as f:
+                runs = json.load(f)
+        writeJSON(runs + [record], recordPath)
+        tables.append(status.assign(nx=params['nx'], ny=params['ny']))
+    return pd.concat(tables, ignore_index=True)
@@ -0,0 +1,160 @@
+# Z-score distribution summaries and cohort sidecars for Getis Ord Hotspot Analysis
+import os
+import json
+import numpy as np
+import pandas as pd
+
+# Default fixed histogram bins (width 1, as in the cohort distplots) and ECDF quantile levels
+HIST_EDGES = np.arange(-20, 61, 1.0)
+QUANTILE_LEVELS = np.linspace(0, 1, 201)
+SUMMARY_SUFFIX = "_Summary.json"
+
+
+# Streaming summary of a Z-score distribution: Z values can be added in any number of chunks and the
+# accumulator keeps only power sums, min/max, a fixed-bin histogram and a fine histogram used as quantile sketch
+class ZSummary:
+
+    def __init__(self, edges=HIST_EDGES, sketch_width=0.01):
+        self.edges = np.asarray(edges, dtype=float)
+        self.counts = np.zeros(len(self.edges) - 1, dtype=np.int64)
+        self.under = 0
+        self.over = 0
+        self.n = 0
+        self.sums = np.zeros(4)
+        self.min = np.inf
+        self.max = -np.inf
+        self.sketch_width = sketch_width
+        self.sketch = {}
+
+    def update(self, z):
+        z = np.asarray(z, dtype=float)
+        z = z[np.isfinite(z)]
+        if z.size == 0:
+            return self
+        self.n += z.size
+        zk = np.ones_like(z)
+        for k in range(4):
+            zk *= z
+            self.sums[k] += np.sum(zk)
+        self.min = min(self.min, np.min(z))
+        self.max = max(self.max, np.max(z))
+        self.counts += np.histogram(z, bins=self.edges)[0]
+        self.under += int(np.sum(z < self.edges[0]))
+        self.over += int(np.sum(z > self.edges[-1]))
+        cells, cellCounts = np.unique(np.floor(z / self.sketch_width).astype(np.int64), return_counts=True)
+        for cell, count in zip(cells.tolist(), cellCounts.tolist()):
+            self.sketch[cell] = self.sketch.get(cell, 0) + count
+        return self
+
+    # Mean, SD (ddof=1, as pandas), Skew and Kurtosis (biased, as scipy.stats) from the power sums
+    def moments(self):
+        n = self.n
+        if n == 0:
+            return {'N':0, 'Mean':np.nan, 'SD':np.nan, 'Skew':np.nan, 'Kurtosis':np.nan}
+        s1, s2, s3, s4 = self.sums / n
+        m2 = s2 - s1**2
+        m3 = s3 - 3*s1*s2 + 2*s1**3
+        m4 = s4 - 4*s1*s3 + 6*s1**2*s2 - 3*s1**4
+        return {'N':n, 'Mean':s1,
+                'SD':np.sqrt(m2*n/(n - 1)) if n > 1 else np.nan,
+                'Skew':m3 / m2**1.5 if m2 > 0 else np.nan,
+                'Kurtosis':m4 / m2**2 - 3 if m2 > 0 else np.nan}
+
+    # Quantiles at the given levels from the sketch, accurate to sketch_width
+    def quantiles(self, levels=QUANTILE_LEVELS):
+        if self.n == 0:
+            return np.full(len(levels), np.nan)
+        cells = np.array(sorted(self.sketch))
+        cdf = np.cumsum([self.sketch[c] for c in cells]) / self.n
+        idx = np.searchsorted(cdf, np.asarray(levels) - 1e-12)
+        values = (cells[np.minimum(idx, len(cells) - 1)] + 0.5)*self.sketch_width
+        return np.clip(values, self.min, self.max)
+
+    def asdict(self, levels=QUANTILE_LEVELS):
+        summary = self.moments()
+        summary.update({'Min':self.min, 'Max':self.max,
+                        'histogram':{'edges':self.edges.tolist(), 'counts':self.counts.tolist(),
+                                     'under':self.under, 'over':self.over},
+                        'quantiles':{'levels':np.asarray(levels).tolist(),
+                                     'values':self.quantiles(levels).tolist()}})
+        return summary
+
+
+
+# Summary of a stats table's Z-scores, plus the same summary for every region in `regions` (e.g. the DM/VM/DL/VL
+# quadrant tables from processedStats)
+def summarizeStats(stats, regions=None, edges=HIST_EDGES, levels=QUANTILE_LEVELS):
+    summary = ZSummary(edges).update(stats['Z-Score']).asdict(levels)
+    summary['regions'] = {name:ZSummary(edges).update(region['Z-Score']).asdict(levels)
+                          for name, region in (regions or {}).items()}
+    return summary
+
+
+
+# Saves a summary (with any run metadata) as a small JSON sidecar next to the stats file
+def writeSummary(summary, path, metadata=None):
+    summary = dict(summary)
+    summary['metadata'] = dict(metadata or {})
+    with open(path, 'w') as f:
+        json.dump(summary, f, default=float)
+
+
+def readSummary(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+
+# Summary sidecars in `folder` as (Filename, summary) pairs, Filename naming the stats file as in the notebooks
+def summaryFiles(folder):
+    for f in sorted(os.listdir(folder)):
+        if f.endswith(SUMMARY_SUFFIX):
+            yield f[:-len(SUMMARY_SUFFIX)] + "_GetisOrdStats", readSummary(os.path.join(folder, f))
+
+
+# Assembles the cohort-level agg_data table (one row per image: Filename, Mouse, Mean, SD, Skew, Kurtosis, N,
+# run metadata and the Mean/SD/Skew of every region) from the summary sidecars in `folder`, without reading any
+# stats table. Extra keyword arguments (e.g. Age='P21', PartOfStriatum='Mid') are added as constant columns.
+def loadSummaries(folder, **labels):
+    rows = []
+    for filename, summary in summaryFiles(folder):
+        row = {'Filename':filename}
+        row.update({k:v for k, v in summary['metadata'].items() if k not in ('columns',)})
+        row.update({k:summary[k] for k in ('N', 'Mean', 'SD', 'Skew', 'Kurtosis', 'Min', 'Max')})
+        for region, values in summary.get('regions', {}).items():
+            for k in ('Mean', 'SD', 'Skew'):
+                row[region + ' ' + k] = values[k]
+        row.update(labels)
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+# Long-form per-quadrant table (one row per image and region: Mouse, Filename, Quadrant, Mean, SD, Skew, N and run
+# metadata) from the summary sidecars in `folder`, as the ages_quad_data / wt_cko_quad_df tables of
+# AnalyzeHotspotData. Extra keyword arguments (e.g. Group='WT', PartOfStriatum='Mid') are added as constant columns;
+# Quadrant is categorical in the DM, VM, DL, VL order.
+def loadQuadrantSummaries(folder, **labels):
+    rows = []
+    for filename, summary in summaryFiles(folder):
+        metadata = {k:v for k, v in summary['metadata'].items() if k not in ('columns',)}
+        for region, values in summary.get('regions', {}).items():
+            row = dict(metadata, Filename=filename, Quadrant=region)
+            row.update({k:values[k] for k in ('N', 'Mean', 'SD', 'Skew')})
+            row.update(labels)
+            rows.append(row)
+    quadrants = pd.DataFrame(rows)
+    if len(quadrants):
+        quadrants['Quadrant'] = pd.Categorical(quadrants['Quadrant'], categories=['DM', 'VM', 'DL', 'VL'])
+    return quadrants
+
+
+
+# Bin centers and counts of the stored histogram, for bar/distplot-style figures
+def summaryHistogram(summary):
+    edges = np.asarray(summary['histogram']['edges'])
+    return (edges[:-1] + edges[1:]) / 2, np.asarray(summary['histogram']['counts'])
+
+
+# ECDF curve (Z values and cumulative fractions) from the stored quantiles
+def summaryECDF(summary):
+    return np.asarray(summary['quantiles']['values']), np.asarray(summary['quantiles']['levels'])
@@ -0,0 +1,21 @@
+# Small shared helpers (no heavy imports) for Getis Ord Hotspot Analysis
+import os
+import json
+import subprocess
+
+
+# Writes `obj` as JSON through a temporary file renamed into place, so readers never see a partial file
+def writeJSON(obj, path):
+    tmpPath = path + '.tmp'
+    with open(tmpPath, 'w') as f:
+        json.dump(obj, f, indent=1)
+    os.replace(tmpPath, path)
+
+
+# Commit of the code being run, if it is a git checkout
+def gitCommit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
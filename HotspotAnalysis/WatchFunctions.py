@@ -0,0 +1,198 @@
+# Watch-folder ingestion for Getis Ord Hotspot Analysis
+import os
+import time
+import socket
+from BatchFunctions import *
+
+STATUS_NAME = 'hotspot_status.json'
+# Endings of files that are still being copied in
+PARTIAL_SUFFIXES = ('.tmp', '.part', '.partial', '.crdownload')
+
+
+# Name shared by an image and its ROI: the file name without its extension and its '_img' or '_roi' ending
+def pairKey(fileName):
+    stem = fileName.rsplit('.', 1)[0]
+    for ending in ('_img', '_roi'):
+        if stem.lower().endswith(ending):
+            return stem[:-len(ending)]
+    return stem
+
+
+# Image/ROI pairs currently in filesDir as {pair key: (image, ROI)}. Hidden files, files still being copied and
+# images whose ROI has not arrived yet are left out.
+def imageROIPairs(filesDir):
+    def listing(folder):
+        if not os.path.isdir(folder):
+            return {}
+        return {pairKey(f):f for f in sorted(os.listdir(folder))
+                if not f.startswith('.') and not f.lower().endswith(PARTIAL_SUFFIXES)}
+    images = listing(os.path.join(filesDir, 'Images'))
+    ROIs = listing(os.path.join(filesDir, 'ROIs'))
+    return {key:(images[key], ROIs[key]) for key in images if key in ROIs}
+
+
+def timestamp(seconds):
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(seconds))
+
+
+
+# Long-running ingestion of a folder that microscopes export into. Every poll lists the image/ROI pairs of
+# filesDir and waits until a pair is stable: the same size and modification time as on the previous poll, and last
+# modified at least `settle` seconds ago. A stable pair is queued for every parameter set (dicts of processImage
+# arguments, as in resolveRunConfig) whose manifest does not already hold complete outputs of the same files, so
+# only new or changed pairs are analyzed. At most `workers` images are analyzed at a time, each finished image is
+# recorded in the manifest shared with BatchHotspot_pool, and failed images are retried once their files change.
+# Images lost with a worker that died are rerun on a fresh pool (see WorkerPool), so only the image that crashes a
+# worker on its own is failed.
+# A status file (hotspot_status.json in filesDir by default) is rewritten on every poll for monitoring.
+class HotspotWatcher:
+
+    def __init__(self, filesDir, paramSets, workers=1, settle=30, max_memory=None, cache=None, statusPath=None):
+        self.filesDir = filesDir
+        self.paramSets = paramSets
+        self.workers = workers
+        self.settle = settle
+        self.max_memory = max_memory
+        self.cache = cache
+        self.statusPath = statusPath if statusPath is not None else os.path.join(filesDir, STATUS_NAME)
+        self.jobs = WorkerPool(workers, max_memory)
+        self.state = 'starting'
+        self.started = time.time()
+        self.seen = {}
+        self.complete = {}
+        self.failures = {}
+        self.done = 0
+        self.failed = 0
+        self.lastDone = None
+
+    # Pairs that were stable on this poll, as (image, ROI, sources)
+    def stablePairs(self):
+        now = time.time()
+        stable = []
+        seen = {}
+        for key, (image, ROI) in imageROIPairs(self.filesDir).items():
+            try:
+                sources = imageSources(self.filesDir, image, ROI)
+            except FileNotFoundError:
+                continue
+            seen[key] = (image, ROI, sources)
+            modified = max(sources['image'][1], sources['roi'][1]) / 1e9
+            if self.seen.get(key) == seen[key] and now - modified >= self.settle:
+                stable.append(seen[key])
+        self.seen = seen
+        return stable
+
+    # Queues the stable pairs that have no complete outputs yet for each parameter set
+    def enqueue(self, stable):
+        waiting = {(job[1], job[4]) for job in self.jobs.jobs()}
+        for params in self.paramSets:
+            outDir = params['saveDir'] if params['saveDir'] is not None else self.filesDir
+            manifestPath = os.path.join(outDir, MANIFEST_NAME)
+            manifest = None
+            for image, ROI, sources in stable:
+                name = outputName(image, params['nx'], params['ny'])
+                key = (manifestPath, name)
+                if key in waiting or self.complete.get(key) == sources:
+                    continue
+                if self.failures.get(key, {}).get('sources') == sources:
+                    continue
+                if manifest is None:
+                    manifest = readManifest(manifestPath)
+                entryParams = manifestParams(params['threshold'], params['downsample'], params['nx'], params['ny'],
+                                             params['saveDir'], params['output_format'], params['native_depth'])
+                if name in manifest and isComplete(manifest[name], entryParams, sources):
+                    self.complete[key] = sources
+                    continue
+                self.add(params, manifestPath, image, ROI, name, sources)
+
+    # Queues the analysis of one image with one parameter set
+    def add(self, params, manifestPath, image, ROI, name, sources):
+        self.jobs.add((manifestPath, name), (params, manifestPath, image, ROI, name, sources), processImage,
+                      self.filesDir, image, ROI, params['threshold'], params['downsample'], params['nx'], params['ny'],
+                      params['saveDir'], self.cache, params['output_format'], params['figures'],
+                      params['figure_format'], None, params['profile'], params['native_depth'])
+
+    # Keeps `workers` images in flight
+    def submit(self):
+        self.jobs.submit()
+
+    # Records the finished images in their manifests
+    def collect(self):
+        for (params, manifestPath, image, ROI, name, sources), outputs, e in self.jobs.collect():
+            key = (manifestPath, name)
+            if e is not None:
+                print("Hotspot analysis of %s failed: %r" % (image, e))
+                self.failures[key] = {'image':image, 'name':name, 'sources':sources, 'error':repr(e),
+                                      'time':timestamp(time.time())}
+                self.failed += 1
+                continue
+            manifest = readManifest(manifestPath)
+            manifest[name] = manifestEntry(manifestParams(params['threshold'], params['downsample'], params['nx'],
+                                                          params['ny'], params['saveDir'], params['output_format'],
+                                                          params['native_depth']),
+                                           sources, outputs)
+            writeManifest(manifest, manifestPath)
+            self.complete[key] = sources
+            self.failures.pop(key, None)
+            self.done += 1
+            self.lastDone = {'image':image, 'name':name, 'time':timestamp(time.time())}
+
+    def status(self):
+        return {'state':self.state, 'host':socket.gethostname(), 'pid':os.getpid(), 'filesDir':self.filesDir,
+                'started':timestamp(self.started), 'heartbeat':timestamp(time.time()), 'heartbeat_unix':time.time(),
+                'workers':self.workers, 'settle':self.settle, 'pairs':len(self.seen), 'queued':len(self.jobs.queue),
+                'running':[item[1][4] for item in self.jobs.running.values()], 'retrying':len(self.jobs.tries),
+                'done':self.done, 'failed':self.failed,
+                'last_done':self.lastDone,
+                'failures':[{k:v for k, v in f.items() if k != 'sources'} for f in self.failures.values()]}
+
+    def writeStatus(self):
+        writeJSON(self.status(), self.statusPath)
+
+    def poll(self):
+        self.collect()
+        self.enqueue(self.stablePairs())
+        self.submit()
+        self.writeStatus()
+
+    # Polls every `interval` seconds (or max_polls times, then finishes the queued images) until interrupted
+    def run(self, interval=10, max_polls=None):
+        self.state = 'running'
+        polls = 0
+        try:
+            while max_polls is None or polls < max_polls:
+                self.poll()
+                polls += 1
+                if self.jobs.running:
+                    self.jobs.wait(interval)
+                else:
+                    time.sleep(interval)
+            while self.jobs.queue or self.jobs.running:
+                self.jobs.wait()
+                self.collect()
+                self.submit()
+                self.writeStatus()
+        except KeyboardInterrupt:
+            self.jobs.queue = []
+        finally:
+            self.state = 'stopping'
+            self.writeStatus()
+            self.jobs.shutdown()
+            self.collect()
+            self.state = 'stopped'
+            self.writeStatus()
+        return self.status()
+
+
+
+# Watches the filesDir of a run config (a dict or the path of a YAML/JSON file) and analyzes new or changed
+# image/ROI pairs with every parameter set of the config as they arrive
+def watchConfig(config, interval=10, settle=30, max_polls=None):
+    from RunFunctions import readRunConfig, resolveRunConfig
+    if isinstance(config, str):
+        config = readRunConfig(config)
+    config = resolveRunConfig(config)
+    cache = GetisCache(config['cache'], config['cache_bytes']) if config['cache'] is not None else None
+    watcher = HotspotWatcher(config['filesDir'], config['params'], config['workers'] or 1, settle,
+                             config['max_memory'], cache)
+    return watcher.run(interval, max_polls)
@@ -0,0 +1,44 @@
+# Command line entry point for headless Getis Ord Hotspot Analysis batch jobs, e.g.
+#   python hotspot_cli.py run config.yaml
+#   python hotspot_cli.py watch config.yaml --interval 10 --settle 30
+import os
+import sys
+import argparse
+import matplotlib
+matplotlib.use('Agg')
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'HotspotAnalysis'))
+
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='hotspot', description="Headless Getis Ord Hotspot Analysis")
+    commands = parser.add_subparsers(dest='command', required=True)
+    run = commands.add_parser('run', help="run the batch analysis described by a YAML run config")
+    run.add_argument('config', help="YAML (or JSON) run config")
+    run.add_argument('--workers', type=int, help="override the worker count of the config")
+    watch = commands.add_parser('watch', help="keep analyzing new or changed image/ROI pairs as they arrive")
+    watch.add_argument('config', help="YAML (or JSON) run config")
+    watch.add_argument('--workers', type=int, help="override the worker count of the config")
+    watch.add_argument('--interval', type=float, default=10, help="seconds between polls of the folder")
+    watch.add_argument('--settle', type=float, default=30,
+                       help="seconds a pair must be left unchanged before it is analyzed")
+    watch.add_argument('--max-polls', type=int, help="stop after this many polls (default: run until interrupted)")
+    args = parser.parse_args(argv)
+
+    from RunFunctions import readRunConfig, runConfig
+    config = readRunConfig(args.config)
+    if args.workers is not None:
+        config['workers'] = args.workers
+    if args.command == 'run':
+        status = runConfig(config, source=args.config)
+        print(status.groupby(['nx', 'ny', 'Status']).size().to_string())
+        return 1 if (status['Status'] == 'failed').any() else 0
+    from WatchFunctions import watchConfig
+    status = watchConfig(config, args.interval, args.settle, args.max_polls)
+    print("Analyzed %d images, %d failed" % (status['done'], status['failed']))
+    return 0
+
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,146 @@
+# Numerical equivalence of the summed-area-table engine with the reference per-neighborhood Getis
+import numpy as np
+import pytest
+from AnalysisFunctions import Getis, Getis_parallel
+from EngineFunctions import Getis_integral, Getis_tiled, Getis_chunked, Getis_multiROI, bytesPerRow, STATS_COLUMNS
+from EngineFunctions import regionMasks, regionMoments, precisionDeviation, FLOAT_COLUMNS
+
+
+# Seeded section: noise with one bright patch, inside an elliptical ROI
+def section(seed, H, W, dtype):
+    rng = np.random.default_rng(seed)
+    img = rng.integers(0, 200, (H, W)).astype(dtype)
+    img[50:90, 60:120] += 50
+    rows, cols = np.mgrid[:H, :W]
+    mask = ((rows - H/2)**2/(H/2.2)**2 + (cols - W/2)**2/(W/2.3)**2) < 1
+    return mask, np.ma.array(img, mask=~mask)
+
+
+# Same neighborhoods, in the same order, with the same statistics
+def assertSameStats(stats, reference):
+    assert list(stats.columns) == STATS_COLUMNS
+    assert stats[['x', 'y', 'nx', 'ny']].to_numpy().tolist() == reference[['x', 'y', 'nx', 'ny']].to_numpy().tolist()
+    for column in STATS_COLUMNS[4:-1]:
+        assert np.allclose(stats[column].to_numpy(float), reference[column].to_numpy(float)), column
+    assert (stats['Sign'].to_numpy() == reference['Sign'].to_numpy()).all()
+
+
+@pytest.mark.parametrize('seed, dtype, nx, ny', [(0, np.uint8, 20, 20), (1, np.uint16, 20, 20),
+                                                  (2, np.uint8, 10, 30)])
+def test_integral_matches_getis(seed, dtype, nx, ny):
+    mask, maskedImage = section(seed, 200, 180, dtype)
+    reference = Getis(mask, maskedImage, nx, ny).sort_values(['x', 'y'], ignore_index=True)
+    stats = Getis_integral(mask, maskedImage, nx, ny).sort_values(['x', 'y'], ignore_index=True)
+    assert len(reference) > 0
+    assert list(stats.columns) == STATS_COLUMNS
+    assert len(stats) == len(reference)
+    for column in STATS_COLUMNS[:-1]:
+        assert np.allclose(stats[column].to_numpy(float), reference[column].to_numpy(float)), column
+    assert (stats['Sign'].to_numpy() == reference['Sign'].to_numpy()).all()
+
+
+def test_getis_empty_roi():
+    mask, maskedImage = section(0, 60, 60, np.uint8)
+    stats = Getis(np.zeros_like(mask), maskedImage, 20, 20)
+    assert len(stats) == 0
+    assert list(stats.columns) == STATS_COLUMNS
+
+
+@pytest.mark.parametrize('scheduler', ['threads', 'processes'])
+@pytest.mark.parametrize('tile, min_coverage', [((64, 64), 1.0), ((3, 5), 1.0), ((1, 7), 0.5), ((4, 4), 0.75)])
+def test_tiled_matches_integral(scheduler, tile, min_coverage):
+    mask, maskedImage = section(3, 200, 180, np.uint16)
+    reference = Getis_integral(mask, maskedImage, 10, 10, min_coverage)
+    assert len(reference) > 0
+    assertSameStats(Getis_tiled(mask, maskedImage, 10, 10, workers=2, scheduler=scheduler, tile=tile,
+                                min_coverage=min_coverage), reference)
+
+
+@pytest.mark.parametrize('scheduler', ['threads', 'processes'])
+def test_parallel_matches_integral(scheduler):
+    mask, maskedImage = section(4, 160, 200, np.uint8)
+    assertSameStats(Getis_parallel(mask, maskedImage, 20, 20, workers=2, scheduler=scheduler, min_coverage=0.5),
+                    Getis_integral(mask, maskedImage, 20, 20, 0.5))
+
+
+@pytest.mark.parametrize('min_coverage', [1.0, 0.5])
+def test_chunked_memmap_matches_integral(tmp_path, min_coverage):
+    mask, maskedImage = section(5, 200, 180, np.uint16)
+    image = np.memmap(tmp_path / 'image.dat', dtype=np.uint16, mode='w+', shape=mask.shape)
+    image[:] = maskedImage.data
+    maskMap = np.memmap(tmp_path / 'mask.dat', dtype=bool, mode='w+', shape=mask.shape)
+    maskMap[:] = mask
+    # Room for 30 rows: several bands of neighborhood rows, each read with its halo
+    budget = 30*bytesPerRow(180, 2)
+    assertSameStats(Getis_chunked(maskMap, image, 10, 10, memory_budget=budget, min_coverage=min_coverage),
+                    Getis_integral(mask, maskedImage, 10, 10, min_coverage))
+
+
+def test_chunked_budget_too_small():
+    mask, maskedImage = section(5, 100, 90, np.uint8)
+    with pytest.raises(Exception, match="memory_budget is too small"):
+        Getis_chunked(mask, maskedImage.data, 20, 20, memory_budget=10*bytesPerRow(90, 1))
+
+
+# Two elliptical regions of one section, as full-frame masks and as a label image
+def regionSet(H, W):
+    rows, cols = np.mgrid[:H, :W]
+    left = ((rows - H/2)**2/(H/2.5)**2 + (cols - W/4)**2/(W/5)**2) < 1
+    right = ((rows - H/2)**2/(H/3)**2 + (cols - 3*W/4)**2/(W/5)**2) < 1
+    labels = np.zeros((H, W), dtype=np.int32)
+    labels[left] = 1
+    labels[right] = 2
+    return {'left':left, 'right':right}, labels
+
+
+@pytest.mark.parametrize('form', ['masks', 'labels'])
+@pytest.mark.parametrize('min_coverage', [1.0, 0.5])
+def test_multiROI_matches_integral(form, min_coverage):
+    img = section(6, 200, 240, np.uint16)[1].data
+    masks, labels = regionSet(200, 240)
+    rois, names = (masks, None) if form == 'masks' else (labels, {1:'left', 2:'right'})
+    results, bounds = Getis_multiROI(rois, img, 10, 10, min_coverage, names=names)
+    assert sorted(results) == ['left', 'right']
+    for name, mask in masks.items():
+        xmin, xmax, ymin, ymax = bounds[name]
+        crop = mask[xmin:xmax, ymin:ymax]
+        reference = Getis_integral(crop, np.ma.array(img[xmin:xmax, ymin:ymax], mask=~crop), 10, 10, min_coverage)
+        assert len(reference) > 0
+        assertSameStats(results[name], reference)
+
+
+# Sums of squares of bright uint16 regions past 2**53, where float64 accumulation is no longer exact
+def test_region_moments_exact():
+    rng = np.random.default_rng(7)
+    img = rng.integers(60000, 2**16, (2400, 2400)).astype(np.uint16)
+    labels = np.ones(img.shape, dtype=np.int32)
+    labels[:, 1200:] = 2
+    masks = {1:labels == 1, 2:labels == 2}
+    for rois in (labels, masks):
+        moments = regionMoments(img, rois, regionMasks(rois), exact=True)
+        for label in (1, 2):
+            values = img[labels == label].astype(np.int64)
+            assert int(np.sum(values**2)) > 2**53
+            assert moments[label][:2] == (int(np.sum(values)), int(np.sum(values**2)))
+            assert moments[label][2] == values.size
+
+
+def test_exact_precision_matches_float64():
+    mask, maskedImage = section(8, 200, 180, np.uint16)
+    deviation = precisionDeviation(mask, maskedImage, 10, 10, 'exact', min_coverage=0.5)
+    assert (deviation[FLOAT_COLUMNS] == 0).all()
+    assert deviation['Same neighborhoods'] and deviation['Same signs']
+
+
+@pytest.mark.parametrize('form', ['masks', 'labels'])
+def test_multiROI_exact_matches_integral(form):
+    img = section(9, 200, 240, np.uint16)[1].data
+    masks, labels = regionSet(200, 240)
+    rois, names = (masks, None) if form == 'masks' else (labels, {1:'left', 2:'right'})
+    results, bounds = Getis_multiROI(rois, img, 10, 10, names=names, precision='exact')
+    for name, mask in masks.items():
+        xmin, xmax, ymin, ymax = bounds[name]
+        crop = mask[xmin:xmax, ymin:ymax]
+        reference = Getis_integral(crop, np.ma.array(img[xmin:xmax, ymin:ymax], mask=~crop), 10, 10,
+                                   precision='exact')
+        assert results[name].equals(reference)
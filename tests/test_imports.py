@@ -0,0 +1,12 @@
+# Import budget of the compute-only path: what every pool worker loads must stay lazy about heavy dependencies
+import pytest
+from BenchmarkFunctions import importCost, IMPORT_MODULES, IMPORT_BUDGET
+
+
+@pytest.mark.parametrize('module', IMPORT_MODULES)
+def test_import_budget(module):
+    cost = importCost(module)
+    assert cost['heavy'] == [], module + " loads " + str(cost['heavy'])
+    # Looser than IMPORT_BUDGET, which is meant for `BenchmarkFunctions.py imports` on a quiet machine
+    assert cost['seconds'] < 4*IMPORT_BUDGET['seconds']
+    assert cost['rss_mb'] < 2*IMPORT_BUDGET['rss_mb']
@@ -0,0 +1,29 @@
+# Per-image profiles written by the batch functions
+import json
+import numpy as np
+import cv2
+from BatchFunctions import BatchHotspot, outputName
+from InstrumentFunctions import PROFILE_SUFFIX
+
+
+def test_profile_records_carry_image(tmp_path):
+    (tmp_path / 'Images').mkdir()
+    (tmp_path / 'ROIs').mkdir()
+    rng = np.random.default_rng(0)
+    images, ROIs = [], []
+    for i in range(2):
+        roi = np.zeros((90, 80), np.uint8)
+        roi[10:80, 10:70] = 255
+        images.append('Mouse%d_sectionA1R_img.tif' % i)
+        ROIs.append('Mouse%d_sectionA1R_roi.tif' % i)
+        cv2.imwrite(str(tmp_path / 'Images' / images[-1]), rng.integers(0, 200, (90, 80)).astype(np.uint8))
+        cv2.imwrite(str(tmp_path / 'ROIs' / ROIs[-1]), roi)
+
+    BatchHotspot(str(tmp_path) + '/', images, ROIs, 250, False, 10, 10, saveDir=str(tmp_path / 'out'),
+                 figure_format='none')
+    for image in images:
+        name = outputName(image, 10, 10)
+        with open(tmp_path / 'out' / (name + PROFILE_SUFFIX)) as f:
+            records = [json.loads(line) for line in f if line.strip()]
+        assert {'load', 'getis', 'image'} <= {record['stage'] for record in records}
+        assert all(record.get('image') == name for record in records)
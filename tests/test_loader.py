@@ -0,0 +1,43 @@
+# Channel selection of ImageLoader across TIFF layouts
+import numpy as np
+import pytest
+import tifffile
+from AnalysisFunctions import ImageLoader
+
+Y, X = 40, 30
+
+
+# Stack of C channels and Z planes whose every plane is distinct: planes[c, z]
+def planes(C, Z, dtype=np.uint16):
+    rng = np.random.default_rng(C*10 + Z)
+    return rng.integers(0, 1000, (C, Z, Y, X)).astype(dtype)
+
+
+# {layout: (arrangement of planes[c, z] into the array written, imwrite arguments)}
+LAYOUTS = {
+    'CZYX': (lambda p: p, {'ome':True, 'metadata':{'axes':'CZYX'}}),
+    'ZCYX': (lambda p: p.transpose(1, 0, 2, 3), {'imagej':True, 'metadata':{'axes':'ZCYX'}}),
+    'CYX': (lambda p: p[:, 0], {'imagej':True, 'metadata':{'axes':'CYX'}}),
+    'untagged': (lambda p: p, {}),
+    'planar': (lambda p: p[:, 0].astype(np.uint8), {'photometric':'rgb', 'planarconfig':'separate'}),
+    'interleaved': (lambda p: p[:, 0].transpose(1, 2, 0).astype(np.uint8), {'photometric':'rgb'}),
+}
+
+
+@pytest.mark.parametrize('compression', [None, 'zlib'])
+@pytest.mark.parametrize('layout', list(LAYOUTS))
+def test_tiff_channels(tmp_path, layout, compression):
+    C, Z = (3, 1) if layout in ('CYX', 'planar', 'interleaved') else (3, 2)
+    data = planes(C, Z)
+    arrange, kwargs = LAYOUTS[layout]
+    tifffile.imwrite(tmp_path / 'img.tif', arrange(data), compression=compression, **kwargs)
+
+    with ImageLoader(str(tmp_path), 'img.tif') as loader:
+        assert loader.channels == C
+        assert loader.shape == (Y, X)
+        for c in range(C):
+            expected = data[c, 0].astype(loader.dtype)
+            assert np.array_equal(np.asarray(loader.channel(c)), expected), c
+            assert np.array_equal(np.asarray(loader.channel(c, out='memmap')), expected), c
+        with pytest.raises(Exception, match="does not exist"):
+            loader.channel(C)
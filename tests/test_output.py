@@ -0,0 +1,60 @@
+# Round trips of stats tables through writeStats / readStats
+import numpy as np
+import pytest
+from EngineFunctions import Getis_integral, STATS_COLUMNS
+from OutputFunctions import writeStats, readStats, readStatsMetadata
+from test_engine import section
+
+
+FORMATS = ['npz', 'parquet', 'csv']
+
+
+@pytest.fixture
+def stats():
+    mask, maskedImage = section(0, 120, 100, np.uint16)
+    stats = Getis_integral(mask, maskedImage, 10, 10)
+    assert set(stats['Sign']) == {'+', '-'}
+    return stats
+
+
+@pytest.mark.parametrize('fmt', FORMATS)
+def test_stats_round_trip(tmp_path, stats, fmt):
+    if fmt == 'parquet':
+        pytest.importorskip('pyarrow')
+    path = str(tmp_path / ('stats.' + fmt))
+    writeStats(stats, path, {'threshold':200, 'nx':10, 'ny':10, 'direction':'R'})
+    loaded = readStats(path)
+
+    assert list(loaded.columns) == STATS_COLUMNS
+    assert list(loaded['Sign']) == list(stats['Sign'])
+    # Binary formats are exact; CSV text is parsed back by pandas' fast, not round-trip, float parser
+    same = np.array_equal if fmt != 'csv' else lambda a, b: np.allclose(a, b, rtol=1e-12, atol=0)
+    for column in STATS_COLUMNS[:-1]:
+        assert same(loaded[column].to_numpy(), stats[column].to_numpy()), column
+    subset = readStats(path, columns=['x', 'Z-Score', 'Sign'])
+    assert list(subset.columns) == ['x', 'Z-Score', 'Sign']
+    assert same(subset['Z-Score'].to_numpy(), stats['Z-Score'].to_numpy())
+    assert list(subset['Sign']) == list(stats['Sign'])
+
+
+@pytest.mark.parametrize('fmt', [f for f in FORMATS if f != 'csv'])
+def test_stats_typed_columns_and_metadata(tmp_path, stats, fmt):
+    if fmt == 'parquet':
+        pytest.importorskip('pyarrow')
+    path = str(tmp_path / ('stats.' + fmt))
+    writeStats(stats, path, {'threshold':200, 'nx':10, 'ny':10, 'direction':'R'})
+    if fmt == 'npz':
+        with np.load(path) as data:
+            assert all(data[column].dtype == np.int32 for column in ['x', 'y', 'nx', 'ny'])
+            assert data['Sign'].dtype == np.int8
+            assert set(np.unique(data['Sign'])) == {-1, 1}
+    loaded = readStats(path)
+    assert all(loaded[column].dtype == np.int32 for column in ['x', 'y', 'nx', 'ny'])
+    assert readStatsMetadata(path) == {'threshold':200, 'nx':10, 'ny':10, 'direction':'R', 'columns':STATS_COLUMNS}
+
+
+def test_csv_has_no_metadata(tmp_path, stats):
+    path = str(tmp_path / 'stats.csv')
+    writeStats(stats, path)
+    with pytest.raises(Exception, match="carry metadata"):
+        readStatsMetadata(path)
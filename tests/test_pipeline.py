@@ -0,0 +1,51 @@
+# BatchHotspot_pipeline against the sequential BatchHotspot
+import json
+import numpy as np
+import cv2
+from BatchFunctions import BatchHotspot, BatchHotspot_pipeline, outputName
+from InstrumentFunctions import PROFILE_SUFFIX
+from FigureFunctions import STATS_SUFFIX
+from SummaryFunctions import SUMMARY_SUFFIX
+
+
+# Folder of `count` synthetic image/ROI pairs in the Images/ and ROIs/ layout
+def filesFolder(tmp_path, count):
+    (tmp_path / 'Images').mkdir()
+    (tmp_path / 'ROIs').mkdir()
+    rng = np.random.default_rng(1)
+    images, ROIs = [], []
+    for i in range(count):
+        img = rng.integers(0, 200, (96, 88)).astype(np.uint8)
+        img[20:50, 30:60] += 50
+        roi = np.zeros((96, 88), np.uint8)
+        roi[8:88, 6:80] = 255
+        images.append('Mouse%d_sectionA1R_img.tif' % i)
+        ROIs.append('Mouse%d_sectionA1R_roi.tif' % i)
+        cv2.imwrite(str(tmp_path / 'Images' / images[-1]), img)
+        cv2.imwrite(str(tmp_path / 'ROIs' / ROIs[-1]), roi)
+    return str(tmp_path) + '/', images, ROIs
+
+
+def test_pipeline_matches_batch(tmp_path):
+    filesDir, images, ROIs = filesFolder(tmp_path, 4)
+    BatchHotspot(filesDir, images, ROIs, 220, False, 10, 10, saveDir=str(tmp_path / 'batch'), figure_format='none')
+    status = BatchHotspot_pipeline(filesDir, images, ROIs, 220, False, 10, 10, saveDir=str(tmp_path / 'pipeline'),
+                                   figure_format='none', readers=2, writers=2, depth=1)
+    assert (status['Status'] == 'done').all()
+
+    for image in images:
+        name = outputName(image, 10, 10)
+        for suffix in (STATS_SUFFIX + '.csv', SUMMARY_SUFFIX):
+            batch = (tmp_path / 'batch' / (name + suffix)).read_bytes()
+            assert (tmp_path / 'pipeline' / (name + suffix)).read_bytes() == batch, name + suffix
+
+        with open(tmp_path / 'pipeline' / (name + PROFILE_SUFFIX)) as f:
+            records = [json.loads(line) for line in f if line.strip()]
+        assert all(record['image'] == name for record in records)
+        # The image total is the sum of its stages, without the time spent queued between them
+        total = [record for record in records if record['stage'] == 'image']
+        stages = [record for record in records if record['stage'] != 'image']
+        assert len(total) == 1 and total[0]['error'] is None
+        assert np.isclose(total[0]['wall_s'], sum(record['wall_s'] for record in stages))
+        assert np.isclose(total[0]['cpu_s'], sum(record['cpu_s'] for record in stages))
+        assert total[0]['counts']['neighborhoods'] > 0
@@ -0,0 +1,29 @@
+# Saturation clamp of preprocessImage at 8 bits and at native bit depth
+import numpy as np
+import cv2
+import pytest
+from AnalysisFunctions import readImage, preprocessImage, depthThreshold
+
+
+@pytest.mark.parametrize('threshold', [200, 37, 254.5])
+def test_native_depth_clamps_like_8bit(tmp_path, threshold):
+    rng = np.random.default_rng(0)
+    img = rng.integers(0, 2**16, (64, 80)).astype(np.uint16)
+    # Pixels on both sides of every step boundary around the threshold
+    step = int(np.floor(threshold))*256
+    img[0, :6] = [step - 1, step, step + 255, step + 256, step + 257, step + 1]
+    path = str(tmp_path / 'img.tif')
+    cv2.imwrite(path, img)
+
+    img8 = readImage(path)
+    native = readImage(path, native_depth=True)
+    assert img8.dtype == np.uint8 and native.dtype == np.uint16
+    assert np.array_equal(img8, (native >> 8).astype(np.uint8))
+    clamped8 = img8 > threshold
+    assert np.array_equal(native > depthThreshold(threshold, native.dtype), clamped8)
+
+    mask = np.ones(img.shape, dtype=bool)
+    for image, t in ((img8, threshold), (native, depthThreshold(threshold, native.dtype))):
+        processed = preprocessImage(image, mask, t)[1].data
+        assert np.array_equal(processed[~clamped8], image[~clamped8])
+        assert len(np.unique(processed[clamped8])) == 1
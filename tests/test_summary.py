@@ -0,0 +1,26 @@
+# Summary sidecars reproduce the per-image and per-quadrant cohort tables of AnalyzeHotspotData
+import numpy as np
+import pandas as pd
+import scipy.stats as st
+from SummaryFunctions import summarizeStats, writeSummary, loadSummaries, loadQuadrantSummaries, SUMMARY_SUFFIX
+
+
+def test_quadrant_summaries_match_notebook(tmp_path):
+    rng = np.random.default_rng(0)
+    stats = pd.DataFrame({'Z-Score':rng.gamma(2, 2, 400) - 3})
+    regions = {'DM':stats[:90], 'VM':stats[90:200], 'DL':stats[200:330], 'VL':stats[330:]}
+    name = 'Mouse1_sectionB4R_20x20'
+    writeSummary(summarizeStats(stats, regions), str(tmp_path / (name + SUMMARY_SUFFIX)), {'Mouse':'Mouse1'})
+
+    agg = loadSummaries(str(tmp_path), Group='WT')
+    quadrants = loadQuadrantSummaries(str(tmp_path), Group='WT')
+    assert list(quadrants['Quadrant']) == ['DM', 'VM', 'DL', 'VL']
+    assert (quadrants['Filename'] == name + '_GetisOrdStats').all()
+    assert (quadrants['Mouse'] == 'Mouse1').all() and (quadrants['Group'] == 'WT').all()
+    for row, (region, data) in zip(quadrants.itertuples(), regions.items()):
+        # Notebook: quad_data['Z-Score'].mean(), .std() and scipy.stats.skew
+        assert np.isclose(row.Mean, data['Z-Score'].mean())
+        assert np.isclose(row.SD, data['Z-Score'].std())
+        assert np.isclose(row.Skew, st.skew(data['Z-Score']))
+        assert np.isclose(agg[region + ' SD'][0], data['Z-Score'].std())
+    assert np.isclose(agg['SD'][0], stats['Z-Score'].std())
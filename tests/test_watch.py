@@ -0,0 +1,84 @@
+# Recovery of the batch runners from a worker that dies
+import os
+import time
+import BatchFunctions
+import WatchFunctions
+from WatchFunctions import HotspotWatcher
+from BatchFunctions import BatchHotspot_pool, readManifest, MANIFEST_NAME
+
+
+# Stands in for processImage in the workers: images named 'crash...' kill their worker
+def fakeProcessImage(filesDir, image, *args):
+    if image.startswith('crash'):
+        time.sleep(0.2)
+        os._exit(1)
+    time.sleep(0.5)
+    return []
+
+
+def test_watcher_fails_only_the_crashing_image(tmp_path, monkeypatch):
+    monkeypatch.setattr(WatchFunctions, 'processImage', fakeProcessImage)
+    params = {'saveDir':str(tmp_path), 'threshold':200, 'downsample':False, 'nx':10, 'ny':10,
+              'output_format':'csv', 'figures':None, 'figure_format':'none', 'profile':False, 'native_depth':False}
+    watcher = HotspotWatcher(str(tmp_path), [params], workers=3, settle=0)
+    manifestPath = os.path.join(str(tmp_path), MANIFEST_NAME)
+    for image in ['a_img.tif', 'crash_img.tif', 'b_img.tif']:
+        watcher.add(params, manifestPath, image, image, image.split('_')[0], {})
+
+    while watcher.jobs.queue or watcher.jobs.running:
+        watcher.submit()
+        watcher.jobs.wait()
+        watcher.collect()
+    watcher.jobs.shutdown()
+
+    assert watcher.done == 2
+    assert watcher.failed == 1
+    assert [f['image'] for f in watcher.failures.values()] == ['crash_img.tif']
+    assert watcher.jobs.tries == {}
+
+
+def test_pool_runs_the_rest_of_the_batch(tmp_path, monkeypatch):
+    monkeypatch.setattr(BatchFunctions, 'processImage', fakeProcessImage)
+    images = ['a_img.tif', 'crash_img.tif', 'b_img.tif', 'c_img.tif']
+    ROIs = [image.replace('_img', '_roi') for image in images]
+    for folder, names in (('Images', images), ('ROIs', ROIs)):
+        os.makedirs(tmp_path / folder)
+        for name in names:
+            (tmp_path / folder / name).write_bytes(b'0')
+
+    status = BatchHotspot_pool(str(tmp_path) + '/', images, ROIs, 200, False, 10, 10, workers=3,
+                               figure_format='none', profile=False)
+    assert dict(zip(status['Image'], status['Status'])) == {'a_img.tif':'done', 'crash_img.tif':'failed',
+                                                            'b_img.tif':'done', 'c_img.tif':'done'}
+    assert sorted(readManifest(str(tmp_path / MANIFEST_NAME))) == ['a_10x10', 'b_10x10', 'c_10x10']
+
+
+# Stands in for processImage with deferred figures: records how many images the manifest held when it started
+def countingProcessImage(filesDir, image, *args):
+    manifest = readManifest(os.path.join(filesDir, MANIFEST_NAME))
+    path = os.path.join(filesDir, image + '.count')
+    with open(path, 'w') as f:
+        f.write(str(len(manifest)))
+    time.sleep(0.3)
+    return [path]
+
+
+def fakeExportFigures(path, name, *args):
+    return []
+
+
+def test_pool_records_images_while_others_compute(tmp_path, monkeypatch):
+    monkeypatch.setattr(BatchFunctions, 'processImage', countingProcessImage)
+    monkeypatch.setattr(BatchFunctions, 'exportFigures', fakeExportFigures)
+    images = ['a_img.tif', 'b_img.tif', 'c_img.tif']
+    ROIs = [image.replace('_img', '_roi') for image in images]
+    for folder, names in (('Images', images), ('ROIs', ROIs)):
+        os.makedirs(tmp_path / folder)
+        for name in names:
+            (tmp_path / folder / name).write_bytes(b'0')
+
+    status = BatchHotspot_pool(str(tmp_path) + '/', images, ROIs, 200, False, 10, 10, workers=1, figure_workers=1,
+                               profile=False)
+    assert (status['Status'] == 'done').all()
+    # The first images are in the manifest before the last one is analyzed
+    assert (tmp_path / 'c_img.tif.count').read_text() == '2'